@@ -17,9 +17,7 @@ import argparse
 import logging
 import os
 
-from src.CanvasFileDownloader import CanvasFileDownloader
-from src.CanvasToTodoist import CanvasToTodoist
-from src.helpers.LogHelper import notify
+from src.helpers.ConfigHelper import ConfigError
 from src.Utils import setup
 
 os_save_path, config_path, log_path = setup()
@@ -81,6 +79,43 @@ def main():
     parser.add_argument(
         "-y", "--yes", action="store_true", help="Skip confirmation prompts"
     )
+    parser.add_argument(
+        "--full-sync",
+        action="store_true",
+        help="Ignore the local Todoist snapshot and sync state, and re-check every assignment",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="List the files that would be downloaded and their total size, without downloading",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and sync on a schedule and on --trigger commands (implies -y)",
+    )
+    parser.add_argument(
+        "--trigger",
+        metavar="COMMAND",
+        help='Send a command to a running daemon: "sync", "sync course <id or name>", "status" or "stop"',
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="PATH",
+        help="Sync every account config in a directory, or listed in a manifest file (implies -y)",
+    )
+    parser.add_argument(
+        "--batch-workers",
+        type=int,
+        default=4,
+        help="Number of accounts synced at the same time with --batch (default: 4)",
+    )
+    parser.add_argument(
+        "--batch-jitter",
+        type=float,
+        default=30,
+        help="Delay each account's start by up to this many seconds with --batch (default: 30)",
+    )
     parser.add_argument("--reset", action="store_true", help="Reset config file")
     parser.add_argument("-e", "--edit", action="store_true", help="Edit config file")
     parser.add_argument("--logs", action="store_true", help="Show logs")
@@ -101,10 +136,22 @@ def main():
         )
         exit(0)
 
+    if args.trigger:
+        from src.CanvasSyncDaemon import get_socket_path, send_command
+
+        try:
+            print(send_command(args.trigger, get_socket_path(config_path)))
+        except OSError as e:
+            print(f"Could not reach the daemon: {e}")
+            exit(1)
+        exit(0)
+
     if not any([arg in ["-t", "-f", "-a"] for arg in os.sys.argv]):
         # print help if no arguments are provided
         parser.print_help()
         parser.error("Must have either -t, -f, or -a")
+    if args.batch and (args.daemon or args.reset):
+        parser.error("--batch can't be combined with --daemon or --reset")
 
     setup_logging()
     logging.info(f"Logs saved to: {log_path}")
@@ -113,7 +160,41 @@ def main():
     if skip_confirmation_prompts:
         logging.info("Skipping confirmation prompts")
 
+    # Each mode only imports the pipelines and dependencies it uses
+    if args.todoist or args.all:
+        from src.CanvasToTodoist import CanvasToTodoist
+    if args.files or args.all:
+        from src.CanvasFileDownloader import CanvasFileDownloader
+
     try:
+        if args.batch:
+            from src.CanvasSyncBatch import CanvasSyncBatch, load_account_configs
+
+            succeeded = CanvasSyncBatch(
+                args,
+                load_account_configs(args.batch),
+                os_save_path,
+                max_accounts=args.batch_workers,
+                jitter=args.batch_jitter,
+            ).run()
+            exit(0 if succeeded else 1)
+        if args.daemon:
+            from src.CanvasSyncDaemon import CanvasSyncDaemon, get_socket_path
+
+            pipelines = []
+            if args.todoist or args.all:
+                pipelines.append(CanvasToTodoist(args, config_path, True))
+            if args.files or args.all:
+                pipelines.append(
+                    CanvasFileDownloader(args, config_path, os_save_path, True)
+                )
+            interval = pipelines[0].config_helper.get("daemon_interval_minutes")
+            started = CanvasSyncDaemon(
+                pipelines,
+                get_socket_path(config_path),
+                interval_minutes=float(interval or 60),
+            ).serve_forever()
+            exit(0 if started else 1)
         if args.todoist or args.all:
             CanvasToTodoist(args, config_path, skip_confirmation_prompts).run()
             logging.info("")
@@ -125,7 +206,12 @@ def main():
     except KeyboardInterrupt:
         logging.info("Exiting...")
         exit(0)
+    except ConfigError as e:
+        logging.error(e)
+        exit(1)
     except Exception as e:
+        from src.helpers.LogHelper import notify
+
         notify("Canvas-Sync Exception", str(e))
         raise e
 
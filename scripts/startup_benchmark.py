@@ -0,0 +1,111 @@
+"""
+Measures how long each mode of main.py spends importing modules, using `python -X importtime`,
+and fails when a mode goes over its budget or imports a dependency it doesn't use.
+
+Usage: python scripts/startup_benchmark.py [--runs 5] [--budget files=300 ...]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_DEPENDENCIES = ["canvasapi", "todoist_api_python", "bs4", "pick", "notifypy"]
+
+# Mode -> (modules the mode imports, dependencies it must not import)
+MODES = {
+    # --edit, --logs and -h
+    "cli": (["main"], HEAVY_DEPENDENCIES + ["requests"]),
+    "trigger": (["main", "src.CanvasSyncDaemon"], HEAVY_DEPENDENCIES + ["requests"]),
+    "files": (["main", "src.CanvasFileDownloader"], HEAVY_DEPENDENCIES),
+    "todoist": (["main", "src.CanvasToTodoist"], HEAVY_DEPENDENCIES),
+    "daemon": (
+        [
+            "main",
+            "src.CanvasSyncDaemon",
+            "src.CanvasToTodoist",
+            "src.CanvasFileDownloader",
+        ],
+        HEAVY_DEPENDENCIES,
+    ),
+}
+
+# Median import time budgets in milliseconds
+BUDGETS_MS = {"cli": 50, "trigger": 60, "files": 250, "todoist": 250, "daemon": 300}
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(modules):
+    """
+    Imports modules in a fresh interpreter. Returns the total import time in ms of the
+    modules and of everything they import, and the names of all imported modules.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+
+    total_us = 0
+    imported = set()
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        cumulative, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        imported.add(name)
+        if len(indent) == 1 and name.split(".")[0] in ("main", "src"):
+            total_us += cumulative
+    return total_us / 1000, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Runs per mode")
+    parser.add_argument(
+        "--budget",
+        action="append",
+        default=[],
+        metavar="MODE=MS",
+        help="Override the budget of a mode",
+    )
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS_MS)
+    for budget in args.budget:
+        mode, ms = budget.split("=")
+        budgets[mode] = float(ms)
+
+    failures = []
+    print(f"{'mode':<10}{'median':>10}{'budget':>10}")
+    for mode, (modules, forbidden) in MODES.items():
+        times = []
+        for _ in range(args.runs):
+            ms, imported = measure(modules)
+            times.append(ms)
+        median = statistics.median(times)
+        print(f"{mode:<10}{median:>8.1f}ms{budgets[mode]:>8.0f}ms")
+
+        if median > budgets[mode]:
+            failures.append(
+                f"{mode}: {median:.1f}ms is over the {budgets[mode]}ms budget"
+            )
+        unexpected = [name for name in forbidden if name in imported]
+        if unexpected:
+            failures.append(f"{mode}: imports {', '.join(unexpected)}")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
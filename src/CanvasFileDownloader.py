@@ -1,16 +1,24 @@
 import logging
 import os
-import sys
 
 from termcolor import colored
 
+from src.helpers.BlobStoreHelper import BlobStore
 from src.helpers.CanvasHelper import CanvasHelper
-from src.helpers.ConfigHelper import ConfigHelper
+from src.helpers.ConfigHelper import ConfigError, ConfigHelper
+from src.helpers.TransportHelper import CanvasTransport
+from src.Utils import get_cache_path
 
 
 class CanvasFileDownloader:
     def __init__(
-        self, args, config_path, default_save_path, skip_confirmation_prompts=False
+        self,
+        args,
+        config_path,
+        default_save_path,
+        skip_confirmation_prompts=False,
+        transport_options=None,
+        open_blob_store=BlobStore,
     ):
         logging.info(
             colored("# Starting CanvasFileDownloader", attrs=["bold", "reverse"])
@@ -18,6 +26,8 @@ class CanvasFileDownloader:
         self.default_save_path = default_save_path
         self.input_prompt = "> "
         self.skip_confirmation_prompts = skip_confirmation_prompts
+        self.dry_run = getattr(args, "dry_run", False)
+        self.save_paths_loaded = False
         self.param = {"per_page": "100", "include": "submission"}
 
         self.config_helper = ConfigHelper(
@@ -25,13 +35,77 @@ class CanvasFileDownloader:
         )
         heading = str(self.config_helper.get("canvas_api_heading"))
         self.canvas_helper = CanvasHelper(
-            self.config_helper.get("canvas_api_key"), canvas_api_heading=heading
+            self.config_helper.get("canvas_api_key"),
+            canvas_api_heading=heading,
+            max_workers=int(self.config_helper.get("canvas_max_workers") or 8),
+            transport=CanvasTransport.from_config(
+                self.config_helper, **(transport_options or {})
+            ),
+            download_options={
+                "chunk_size": int(
+                    self.config_helper.get("download_chunk_size") or 1024 * 1024
+                ),
+                "segment_threshold": int(
+                    float(
+                        self.config_helper.get("segmented_download_threshold_mb") or 100
+                    )
+                    * 1000000
+                ),
+                "segment_connections": int(
+                    self.config_helper.get("segmented_download_connections") or 4
+                ),
+                "html_engine": self.config_helper.get("html_engine") or "fast",
+                "html_workers": int(
+                    self.config_helper.get("html_process_workers") or 0
+                ),
+                "image_workers": int(
+                    self.config_helper.get("image_download_workers") or 4
+                ),
+                # A dry run doesn't download, so it doesn't create the store either
+                "blob_store": None
+                if self.dry_run
+                else open_blob_store(
+                    self.config_helper.get("blob_store_path")
+                    or os.path.join(default_save_path, ".canvas-sync-store")
+                ),
+            },
+            catalog_path=get_cache_path(
+                "canvas-courses.json", self.config_helper.get("canvas_api_key")
+            ),
+            catalog_ttl=float(self.config_helper.get("course_catalog_ttl_hours") or 24)
+            * 3600,
+            scheduler_options={
+                "max_workers": int(
+                    self.config_helper.get("download_workers")
+                    or self.config_helper.get("canvas_max_workers")
+                    or 8
+                ),
+                "policy": self.config_helper.get("download_policy") or "small-first",
+                "bandwidth_limit": float(
+                    self.config_helper.get("download_bandwidth_limit_mb") or 0
+                )
+                * 1000000,
+            },
         )
+        self.selected_course_ids = None
+        self.select_courses()
+
+    def select_courses(self):
+        """
+        Selects the courses to download, again on every call; their save paths are
+        loaded by the next run
+        """
         self.selected_course_ids = self.canvas_helper.select_courses(
-            self.config_helper, skip_confirmation_prompts=skip_confirmation_prompts
+            self.config_helper,
+            skip_confirmation_prompts=self.skip_confirmation_prompts,
+            default_save_path=self.default_save_path,
         )
+        self.save_paths_loaded = False
 
-    def run(self):
+    def run(self, course_ids=None):
+        """
+        Downloads the files of the selected courses, or only of course_ids
+        """
         logging.info("###################################################")
         logging.info("#               Canvas-File-Downloader            #")
         logging.info("###################################################")
@@ -44,13 +118,20 @@ class CanvasFileDownloader:
             use_previous_input = "y"
 
         if use_previous_input.lower() == "y":
-            self.load_save_paths()
-            self.canvas_helper.download_course_files_all(
-                self.selected_course_ids, self.param
-            )
-            self.canvas_helper.download_module_files_all(
-                self.selected_course_ids, self.param
+            if not self.save_paths_loaded:
+                self.load_save_paths()
+                self.save_paths_loaded = True
+            selected_course_ids = self.selected_course_ids
+            if course_ids is not None:
+                selected_course_ids = {
+                    c_id: selected_course_ids[c_id] for c_id in course_ids
+                }
+            num_downloaded = self.canvas_helper.download_files_all(
+                selected_course_ids, self.param, dry_run=self.dry_run
             )
+            self.canvas_helper.transport.log_stats()
+            return {"downloaded": num_downloaded}
+        return {"downloaded": 0}
 
     def load_save_paths(self):
         has_missing = False
@@ -86,11 +167,10 @@ class CanvasFileDownloader:
             logging.info(f"  - Default: {def_save_path}")
             print(self.skip_confirmation_prompts)
             if self.skip_confirmation_prompts:
-                logging.error(
+                raise ConfigError(
                     "You must configure save paths. "
                     "Please run without -y argument to configure."
                 )
-                sys.exit(1)
             save_path = input(f"  - Enter new path, or press return to use default: ")
             if save_path.strip() == "":
                 save_path = def_save_path
@@ -0,0 +1,271 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from termcolor import colored
+
+from src.helpers.BlobStoreHelper import BlobStore
+from src.helpers.CacheHelper import HttpCache
+from src.helpers.RateLimitHelper import ConcurrencyController
+from src.helpers.TransportHelper import create_session, get_host, log_transport_stats
+from src.Utils import get_cache_path
+
+
+def load_account_configs(path):
+    """
+    Returns the config files of a batch: every *.json file in a directory, or the
+    files listed in a manifest (a JSON list or one path per line), relative to it
+    """
+    if os.path.isdir(path):
+        return [
+            os.path.join(path, name)
+            for name in sorted(os.listdir(path))
+            if name.endswith(".json")
+        ]
+    with open(path) as f:
+        text = f.read()
+    try:
+        config_paths = json.loads(text)
+    except ValueError:
+        config_paths = [line.strip() for line in text.splitlines()]
+    base_dir = os.path.dirname(os.path.abspath(path))
+    return [
+        os.path.join(base_dir, os.path.expanduser(config_path))
+        for config_path in config_paths
+        if config_path and not config_path.startswith("#")
+    ]
+
+
+def _read_config(config_path):
+    """
+    Returns the config as a dict, or an empty one if it can't be read;
+    the account then fails when its pipelines load it
+    """
+    try:
+        with open(config_path) as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def get_canvas_hosts(config_paths):
+    """
+    Returns the Canvas hosts of the account configs
+    """
+    return sorted(
+        {
+            get_host(
+                _read_config(config_path).get("canvas_api_heading")
+                or "https://canvas.instructure.com"
+            )
+            for config_path in config_paths
+        }
+    )
+
+
+def _is_within(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+class CanvasSyncBatch:
+    def __init__(
+        self,
+        args,
+        config_paths,
+        default_save_path,
+        max_accounts=4,
+        jitter=30,
+        max_concurrency=32,
+    ):
+        """
+        Runs CanvasToTodoist and/or CanvasFileDownloader for every account config in
+        config_paths, up to max_accounts at once, without confirmation prompts.
+        All accounts share one session, so its connection pools and a single limit of
+        max_concurrency Canvas requests in flight, and one HTTP cache.
+        By default, each account saves its courses and blob store in its own folder of
+        default_save_path; accounts configured with the same blob_store_path share it.
+        """
+        self.args = args
+        self.default_save_path = default_save_path
+        self.max_accounts = max_accounts
+        self.jitter = jitter
+        # (account name, config path); names are the config file names, made unique
+        self.accounts = []
+        names = set()
+        for config_path in config_paths:
+            base_name = os.path.splitext(os.path.basename(config_path))[0]
+            name, i = base_name, 1
+            while name in names:
+                i += 1
+                name = f"{base_name}-{i}"
+            names.add(name)
+            self.accounts.append((name, config_path))
+        self.controller = ConcurrencyController(
+            initial_limit=min(8, max_concurrency), max_limit=max_concurrency
+        )
+        self.session = create_session(
+            pool_size=max_concurrency,
+            controller=self.controller,
+            limited_hosts=get_canvas_hosts(config_paths),
+        )
+        self.http_cache = HttpCache(get_cache_path("canvas-http-cache.sqlite"))
+        # Blob store root -> the one BlobStore, and sqlite connection, used for it.
+        # Course files are hardlinked from the store, so stores are never shared
+        # between accounts unless their configs name the same blob_store_path
+        self.blob_stores = {}
+        self.blob_stores_lock = threading.Lock()
+
+    def get_save_root(self, name):
+        return os.path.join(self.default_save_path, name)
+
+    def open_blob_store(self, root):
+        """
+        Returns the BlobStore shared by every account that uses root
+        """
+        root = os.path.realpath(root)
+        with self.blob_stores_lock:
+            if root not in self.blob_stores:
+                self.blob_stores[root] = BlobStore(root)
+            return self.blob_stores[root]
+
+    def find_overlapping_save_paths(self):
+        """
+        Returns account name -> error for the accounts whose save paths are the same as,
+        or inside, those of another account; both would write the same files at once
+        """
+        save_paths = []
+        for name, config_path in self.accounts:
+            courses = _read_config(config_path).get("courses")
+            paths = [self.get_save_root(name)]
+            if isinstance(courses, dict):
+                paths.extend(
+                    c_obj["save_path"]
+                    for c_obj in courses.values()
+                    if isinstance(c_obj, dict) and c_obj.get("save_path")
+                )
+            for path in paths:
+                save_paths.append((name, os.path.realpath(os.path.expanduser(path))))
+
+        errors = {}
+        for name, path in save_paths:
+            for other_name, other_path in save_paths:
+                if other_name == name or name in errors:
+                    continue
+                if _is_within(path, other_path) or _is_within(other_path, path):
+                    errors[name] = (
+                        f"save path `{path}` overlaps with `{other_path}` "
+                        f"of account `{other_name}`"
+                    )
+        return errors
+
+    def run(self):
+        """
+        Syncs all accounts and logs one summary. Returns True if every account succeeded.
+        """
+        logging.info(colored("# Starting CanvasSyncBatch", attrs=["bold", "reverse"]))
+        logging.info(
+            f"  - {len(self.accounts)} accounts, {self.max_accounts} at a time"
+        )
+        errors = {}
+        if self.args.files or self.args.all:
+            errors = self.find_overlapping_save_paths()
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_accounts) as executor:
+            results = list(
+                executor.map(
+                    lambda account: self.run_account(*account, errors.get(account[0])),
+                    self.accounts,
+                )
+            )
+        self.log_summary(results, time.monotonic() - start)
+        return all(result["status"] == "ok" for result in results)
+
+    def run_account(self, name, config_path, error=None):
+        result = {"name": name, "status": "ok", "counts": {}, "errors": []}
+        if error is not None:
+            logging.info(colored(f"# Account `{name}`: skipped, {error}", "red"))
+            result.update(status="failed", errors=[error], seconds=0)
+            return result
+        # Spread the start times so accounts don't hit Canvas and Todoist in lockstep
+        time.sleep(random.uniform(0, self.jitter))
+        logging.info(colored(f"# Account `{name}`: {config_path}", attrs=["bold"]))
+        start = time.monotonic()
+        for pipeline in self.create_pipelines(name, config_path):
+            try:
+                result["counts"].update(pipeline() or {})
+            except (Exception, SystemExit) as e:
+                # One account failing, or exiting on a bad config, doesn't stop the others
+                error = str(e) or type(e).__name__
+                if isinstance(e, SystemExit):
+                    error = f"exited with status {e.code}"
+                result["status"] = "failed"
+                result["errors"].append(error)
+                logging.info(colored(f"  - Account `{name}` failed: {error}", "red"))
+                traceback.print_exc()
+        result["seconds"] = time.monotonic() - start
+        return result
+
+    def create_pipelines(self, name, config_path):
+        """
+        Yields a callable per pipeline that creates and runs it,
+        so an error in either step only fails that pipeline
+        """
+        transport_options = {
+            "session": self.session,
+            "controller": self.controller,
+            "http_cache": self.http_cache,
+        }
+        if self.args.todoist or self.args.all:
+            from src.CanvasToTodoist import CanvasToTodoist
+
+            yield lambda: CanvasToTodoist(
+                self.args, config_path, True, transport_options=transport_options
+            ).run()
+        if self.args.files or self.args.all:
+            from src.CanvasFileDownloader import CanvasFileDownloader
+
+            yield lambda: CanvasFileDownloader(
+                self.args,
+                config_path,
+                self.get_save_root(name),
+                True,
+                transport_options=transport_options,
+                open_blob_store=self.open_blob_store,
+            ).run()
+
+    def log_summary(self, results, seconds):
+        num_failed = sum(result["status"] != "ok" for result in results)
+        logging.info("")
+        logging.info("###################################################")
+        logging.info(
+            f"# Batch Summary: {len(results) - num_failed} succeeded, "
+            f"{num_failed} failed in {round(seconds, 1)}s"
+        )
+        totals = {}
+        for i, result in enumerate(results):
+            counts = result["counts"]
+            for key, count in counts.items():
+                totals[key] = totals.get(key, 0) + count
+            details = ", ".join(f"{key}: {count}" for key, count in counts.items())
+            line = (
+                f"  {i + 1}. {result['name']}: {result['status'].upper()} "
+                f"in {round(result['seconds'], 1)}s"
+            )
+            if details:
+                line += f" - {details}"
+            color = "green" if result["status"] == "ok" else "red"
+            logging.info(colored(line, color))
+            for error in result["errors"]:
+                logging.info(colored(f"     - {error}", "red"))
+        if totals:
+            logging.info(
+                "  * Total: " + ", ".join(f"{k}: {v}" for k, v in totals.items())
+            )
+        # Connection, cache and rate limiting stats of the shared session
+        log_transport_stats(self.session, self.http_cache, self.controller)
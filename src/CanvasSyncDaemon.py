@@ -0,0 +1,203 @@
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from termcolor import colored
+
+from src.Utils import get_cache_path
+
+
+def get_socket_path(config_path):
+    """
+    Returns the socket of the daemon running with config_path; one daemon per config
+    """
+    return get_cache_path("daemon.sock", os.path.abspath(config_path))
+
+
+def send_command(command, socket_path, timeout=5):
+    """
+    Sends a command to a running daemon and returns its reply
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(f"{command.strip()}\n".encode("utf-8"))
+        return client.makefile("r", encoding="utf-8").readline().strip()
+
+
+def match_courses(course_ids, query):
+    """
+    Returns the ids of the courses whose id or name matches query,
+    preferring exact matches over name substrings
+    """
+    query = query.strip().lower()
+    exact = [
+        c_id
+        for c_id, c_obj in course_ids.items()
+        if query in (str(c_id).lower(), c_obj["name"].lower())
+    ]
+    if exact:
+        return exact
+    return [
+        c_id for c_id, c_obj in course_ids.items() if query in c_obj["name"].lower()
+    ]
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        command = self.rfile.readline().decode("utf-8").strip()
+        if not command:
+            # A connection without a command, e.g. from is_listening
+            return
+        reply = self.server.sync_daemon.handle_command(command)
+        self.wfile.write(f"{reply}\n".encode("utf-8"))
+
+
+def is_listening(socket_path):
+    """
+    True if a daemon answers on socket_path, False if there is no socket or it is stale
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+    return True
+
+
+class CanvasSyncDaemon:
+    def __init__(self, pipelines, socket_path, interval_minutes=60):
+        """
+        Keeps the pipelines (CanvasToTodoist, CanvasFileDownloader) and their sessions,
+        caches and indexes alive, and runs them every interval_minutes and on commands
+        received on a Unix socket: "sync", "sync course <id or name>", "status" and "stop".
+        Scheduled syncs select the courses again first, so e.g. a new term is picked up.
+        """
+        self.pipelines = pipelines
+        self.interval = interval_minutes * 60
+        self.socket_path = socket_path
+        # Identifies the socket file this daemon created, see stop_server
+        self.socket_id = None
+        self.commands = queue.Queue()
+        self.server = None
+        self.next_run = time.monotonic()
+        self.last_run = None
+        self.running = None
+
+    def handle_command(self, command):
+        """
+        Queues a command from the socket and returns the reply right away
+        """
+        words = command.split()
+        if words == ["sync"]:
+            self.commands.put(("sync", None))
+            return "OK: sync queued"
+        if words[:2] == ["sync", "course"] and len(words) > 2:
+            course = command.split(None, 2)[2]
+            self.commands.put(("sync", course))
+            return f"OK: sync of course `{course}` queued"
+        if words == ["status"]:
+            next_run = max(0, round((self.next_run - time.monotonic()) / 60, 1))
+            return (
+                f"OK: running: {self.running or 'nothing'}, "
+                f"last sync: {self.last_run or 'never'}, next sync in {next_run} min, "
+                f"{self.commands.qsize()} queued"
+            )
+        if words == ["stop"]:
+            self.commands.put(("stop", None))
+            return "OK: stopping"
+        return f"Error: unknown command `{command}`"
+
+    def start_server(self):
+        if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+            logging.info(
+                colored("  - Unix sockets are not supported, only syncing on schedule")
+            )
+            return
+        if is_listening(self.socket_path):
+            raise RuntimeError(
+                f"A daemon is already running for this configuration ({self.socket_path})"
+            )
+        if os.path.exists(self.socket_path):
+            # Left over from a daemon that didn't shut down cleanly
+            os.remove(self.socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path, _CommandHandler
+        )
+        self.server.sync_daemon = self
+        os.chmod(self.socket_path, 0o600)
+        stat = os.stat(self.socket_path)
+        self.socket_id = (stat.st_dev, stat.st_ino)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logging.info(f"  - Listening for commands on {self.socket_path}")
+
+    def stop_server(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            stat = os.stat(self.socket_path)
+        except FileNotFoundError:
+            return
+        # Only remove the socket if it is still ours, not one of a daemon started since
+        if (stat.st_dev, stat.st_ino) == self.socket_id:
+            os.remove(self.socket_path)
+
+    def serve_forever(self):
+        """
+        Syncs until stopped. Returns False if another daemon already runs for the config.
+        """
+        logging.info(colored("# Starting CanvasSyncDaemon", attrs=["bold", "reverse"]))
+        logging.info(f"  - Syncing every {round(self.interval / 60, 1)} min")
+        try:
+            self.start_server()
+        except RuntimeError as e:
+            logging.error(colored(f"  - {e}", "red"))
+            return False
+        try:
+            while True:
+                try:
+                    name, course = self.commands.get(
+                        timeout=max(0, self.next_run - time.monotonic())
+                    )
+                except queue.Empty:
+                    name, course = "sync", None
+                if name == "stop":
+                    break
+                if course is None:
+                    self.next_run = time.monotonic() + self.interval
+                self.sync(course)
+        finally:
+            self.stop_server()
+        return True
+
+    def sync(self, course=None):
+        self.running = "sync" if course is None else f"sync course {course}"
+        logging.info(colored(f"# Daemon: {self.running}", attrs=["bold"]))
+        for pipeline in self.pipelines:
+            try:
+                if course is None and self.last_run is not None:
+                    # Pick up config edits, and courses that course_rules now match
+                    pipeline.config_helper.reload()
+                    pipeline.select_courses()
+                course_ids = None
+                if course is not None and pipeline.selected_course_ids is not None:
+                    course_ids = match_courses(pipeline.selected_course_ids, course)
+                    if not course_ids:
+                        logging.info(f"  - No selected course matches `{course}`")
+                        continue
+                pipeline.run(course_ids)
+            except Exception as e:
+                # Keep the daemon alive; the next sync starts over
+                logging.info(colored(f"  - Error: {e}", "red"))
+                traceback.print_exc()
+            logging.info("")
+        self.last_run = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.running = None
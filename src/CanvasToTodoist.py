@@ -1,23 +1,32 @@
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pprint import pprint
 
 from termcolor import colored
 
+from src.helpers.BudgetHelper import RequestBudget
 from src.helpers.CanvasHelper import CanvasHelper
 from src.helpers.ConfigHelper import ConfigHelper
 from src.helpers.LogHelper import notify
+from src.helpers.SyncStateHelper import SyncStateHelper
 from src.helpers.TodoistHelper import TodoistHelper
+from src.helpers.TodoistSyncHelper import SYNC_URL
+from src.helpers.TransportHelper import CanvasTransport
+from src.Utils import get_cache_path
 
 
 class CanvasToTodoist:
-    def __init__(self, args, config_path, skip_confirmation_prompts=False):
+    def __init__(
+        self, args, config_path, skip_confirmation_prompts=False, transport_options=None
+    ):
         logging.info(colored("Starting CanvasToTodoistr", attrs=["bold", "reverse"]))
         self.skip_confirmation_prompts = skip_confirmation_prompts
         self.param = {"per_page": "100", "include": "submission"}
         self.input_prompt = "> "
         self.selected_course_ids = None
+        self.full_sync = getattr(args, "full_sync", False)
 
         # Loaded configuration files
         self.config_helper = ConfigHelper(
@@ -27,29 +36,97 @@ class CanvasToTodoist:
         self.canvas_helper = CanvasHelper(
             self.config_helper.get("canvas_api_key"),
             canvas_api_heading=str(self.config_helper.get("canvas_api_heading")),
+            max_workers=int(self.config_helper.get("canvas_max_workers") or 8),
+            transport=CanvasTransport.from_config(
+                self.config_helper, **(transport_options or {})
+            ),
+            catalog_path=get_cache_path(
+                "canvas-courses.json", self.config_helper.get("canvas_api_key")
+            ),
+            catalog_ttl=float(self.config_helper.get("course_catalog_ttl_hours") or 24)
+            * 3600,
+        )
+        # Independent network waits at startup run on this executor, see run()
+        self.executor = ThreadPoolExecutor(max_workers=3)
+        todoist_api_key = self.config_helper.get("todoist_api_key")
+        self.todoist_future = self.executor.submit(
+            TodoistHelper,
+            todoist_api_key,
+            sync_url=self.config_helper.get("todoist_sync_url") or SYNC_URL,
+            snapshot_path=get_cache_path("todoist-snapshot.json", todoist_api_key),
+            full_sync=self.full_sync,
+            budget=RequestBudget(
+                get_cache_path("todoist-budget.json", todoist_api_key),
+                limit=int(self.config_helper.get("todoist_request_limit") or 1000),
+            ),
+        )
+        self.sync_state = SyncStateHelper(
+            get_cache_path("sync-state.sqlite", todoist_api_key)
         )
-        self.todoist_helper = TodoistHelper(self.config_helper.get("todoist_api_key"))
 
-    def run(self):
+    @property
+    def todoist_helper(self):
+        # Loading the Todoist snapshot overlaps with Canvas requests until it is first needed
+        return self.todoist_future.result()
+
+    def run(self, course_ids=None):
+        """
+        Transfers the assignments of the selected courses, or only of course_ids.
+        Later runs of the same instance keep the course selection, unless select_courses
+        is called in between, and only refresh the Todoist snapshot incrementally.
+        """
         logging.info("###################################################")
         logging.info("#     Canvas-Assignments-Transfer-For-Todoist     #")
         logging.info("###################################################")
 
-        todoist_project_names = self.todoist_helper.get_project_names()
+        assignments_future = None
+        if self.selected_course_ids is None:
+            # Start on the courses selected last time, which are usually selected again
+            saved_course_ids = self.config_helper.get("courses")
+            if saved_course_ids and course_ids is None:
+                assignments_future = self.executor.submit(
+                    self.canvas_helper.get_assignments, saved_course_ids, self.param
+                )
+            self.select_courses()
+            if assignments_future is not None and list(saved_course_ids) != list(
+                self.selected_course_ids
+            ):
+                assignments_future = None
+        else:
+            self.todoist_helper.refresh()
+
+        selected_course_ids = self.selected_course_ids
+        if course_ids is not None:
+            selected_course_ids = {
+                c_id: selected_course_ids[c_id] for c_id in course_ids
+            }
+        if assignments_future is not None:
+            assignments = assignments_future.result()
+        else:
+            assignments = self.canvas_helper.get_assignments(
+                selected_course_ids, self.param
+            )
+        summary = self.transfer_assignments_to_todoist(assignments)
+        self.canvas_helper.transport.log_stats()
+        self.todoist_helper.log_stats()
+        logging.info("# Finished!")
+        return {key: len(a_list) for key, a_list in summary.items()}
+
+    def select_courses(self):
+        """
+        Selects the courses to transfer, again on every call, and creates their projects
+        """
         self.selected_course_ids = self.canvas_helper.select_courses(
-            self.config_helper, todoist_project_names, self.skip_confirmation_prompts
+            self.config_helper,
+            lambda: self.todoist_helper.get_project_names(),
+            self.skip_confirmation_prompts,
+            executor=self.executor,
         )
         logging.info(self.selected_course_ids)
         course_names = self.canvas_helper.get_course_names(self.selected_course_ids)
 
         self.todoist_helper.create_projects(course_names)
 
-        assignments = self.canvas_helper.get_assignments(
-            self.selected_course_ids, self.param
-        )
-        self.transfer_assignments_to_todoist(assignments)
-        logging.info("# Finished!")
-
     # def check_existing_task(self, assignment, project_id):
     #     """
     #     Checks to see if a task already exists for the assignment.
@@ -109,8 +186,13 @@ class CanvasToTodoist:
             "stale": [],
         }
 
+        # (assignment id, task, content hash, command uuids) recorded once the queue is flushed
+        pending_states = []
+        sync_helper = self.todoist_helper.sync_helper
+
         for i, canvas_assignment in enumerate(assignments):
             # Get the canvas assignment name, due date, course name, todoist project id
+            assignment_id = str(canvas_assignment["id"])
             course_id = str(canvas_assignment["course_id"])
             name = canvas_assignment["name"]
             due_at = canvas_assignment["due_at"]
@@ -125,6 +207,31 @@ class CanvasToTodoist:
 
             logging.info(f'  {i + 1}. Assignment: "{name}"')
 
+            task_priority = TodoistHelper.find_priority(name, due_at)
+            assignments[i]["priority"] = task_priority
+
+            # Skip assignments that have not changed since they were last synced
+            content_hash = SyncStateHelper.make_hash(
+                canvas_assignment, todoist_proj_id, task_priority, submitted
+            )
+            task = None
+            state = None if self.full_sync else self.sync_state.get(assignment_id)
+            if state is not None:
+                state_task_id, state_hash = state
+                if state_task_id is not None:
+                    task = self.todoist_helper.tasks.get(state_task_id)
+                if state_hash == content_hash and (
+                    task is not None or state_task_id is None
+                ):
+                    logging.info("     OK: Unchanged since last sync")
+                    if submitted:
+                        summary["is-submitted"].append(canvas_assignment)
+                    elif task is None:
+                        summary["stale"].append(canvas_assignment)
+                    else:
+                        summary["up-to-date"].append(canvas_assignment)
+                    continue
+
             # Check if the assignment already exists in Todoist and if it needs updating
             # is_added, is_synced, task = self.check_existing_task(c_a, t_proj_id)
             task_title = TodoistHelper.make_link_title(
@@ -134,9 +241,6 @@ class CanvasToTodoist:
                 canvas_assignment["description"]
             )
 
-            task_priority = TodoistHelper.find_priority(name, due_at)
-            assignments[i]["priority"] = task_priority
-
             logging.info(f"     Course: {canvas_course_name} (id: {course_id})")
             logging.info(f"     Due Date: {due_at}")
             logging.info(
@@ -144,7 +248,9 @@ class CanvasToTodoist:
             )
             logging.info(f"     Todoist Project ID: {todoist_proj_id}")
 
-            task = self.todoist_helper.find_task(todoist_proj_id, task_title)
+            if task is None:
+                task = self.todoist_helper.find_task(todoist_proj_id, task_title)
+            mark = sync_helper.mark()
 
             # Handle cases for adding and updating tasks on Todoist
             if task is None:
@@ -153,6 +259,7 @@ class CanvasToTodoist:
                     logging.info(
                         "     INFO: Assignment submitted. Skipping Todoist task."
                     )
+                    pending_states.append((assignment_id, None, content_hash, []))
                     continue
                 if due_at is not None:
                     # parsed format 2023-03-11T04:59:59Z
@@ -164,8 +271,9 @@ class CanvasToTodoist:
                         logging.info(
                             "     INFO: Assignment is stale. Skipping Todoist task."
                         )
+                        pending_states.append((assignment_id, None, content_hash, []))
                         continue
-                task = self.todoist_helper.api.add_task(
+                task = self.todoist_helper.add_task(
                     content=task_title,
                     description=task_description,
                     project_id=todoist_proj_id,
@@ -173,48 +281,67 @@ class CanvasToTodoist:
                     due_string=due_at,
                 )
                 summary["added"].append(canvas_assignment)
+                pending_states.append(
+                    (assignment_id, task, content_hash, sync_helper.uuids_since(mark))
+                )
+                continue
+
+            if submitted:
+                summary["is-submitted"].append(canvas_assignment)
+                logging.info("     INFO: Assignment submitted. Closing Todoist task.")
+                self.todoist_helper.close_task(task)
+                pending_states.append(
+                    (assignment_id, None, content_hash, sync_helper.uuids_since(mark))
+                )
+                continue
+            updates_list = []
+            if task["content"] != task_title:
+                logging.info(f"     UPDATE: title: {task['content']} -> {task_title}")
+                updates_list.append("title")
+            task_due_at = task["due"]["string"] if task["due"] else None
+            if task_due_at != due_at:
+                logging.info(f"     UPDATE: due date: {task_due_at} -> {due_at}")
+                updates_list.append("due date")
+            if task["priority"] != task_priority:
+                updates_list.append("priority")
+                p1 = TodoistHelper.get_priority_name(task["priority"])
+                p2 = TodoistHelper.get_priority_name(task_priority)
+                logging.info(f"     UPDATE: priority: {p1} -> {p2}")
+
+            task_description_curr = self.process_description(task["description"])
+
+            if task_description and task_description_curr != task_description:
+                updates_list.append("description")
+                logging.info(
+                    f"     UPDATE: description: {task_description_curr} -> {task_description}"
+                )
 
-            if task is not None:
-                if submitted:
-                    summary["is-submitted"].append(canvas_assignment)
-                    logging.info(
-                        "     INFO: Assignment submitted. Closing Todoist task."
-                    )
-                    self.todoist_helper.api.close_task(task_id=task.id)
-                    continue
-                updates_list = []
-                if (task.due.string if task.due else None) != due_at:
-                    logging.info(
-                        f"     UPDATE: due date: {task.due.string if task.due else None} -> {due_at}"
-                    )
-                    updates_list.append("due date")
-                if task.priority != task_priority:
-                    updates_list.append("priority")
-                    p1 = TodoistHelper.get_priority_name(task.priority)
-                    p2 = TodoistHelper.get_priority_name(task_priority)
-                    logging.info(f"     UPDATE: priority: {p1} -> {p2}")
-
-                task_description_curr = self.process_description(task.description)
+            if updates_list:
+                self.todoist_helper.update_task(
+                    task,
+                    content=task_title,
+                    description=task_description,
+                    project_id=todoist_proj_id,
+                    priority=task_priority,
+                    due_string=due_at,
+                )
+                summary["updated"].append(canvas_assignment)
+            else:
+                logging.info("     OK: Task is already up to date!")
+                summary["up-to-date"].append(canvas_assignment)
+            pending_states.append(
+                (assignment_id, task, content_hash, sync_helper.uuids_since(mark))
+            )
 
-                if task_description and task_description_curr != task_description:
-                    updates_list.append("description")
-                    logging.info(
-                        f"     UPDATE: description: {task_description_curr} -> {task_description}"
-                    )
+        # Send all queued additions, updates and closures to Todoist
+        self.todoist_helper.flush()
 
-                if updates_list:
-                    self.todoist_helper.api.update_task(
-                        task_id=task.id,
-                        content=task_title,
-                        description=task_description,
-                        project_id=todoist_proj_id,
-                        priority=task_priority,
-                        due_string=due_at,
-                    )
-                    summary["updated"].append(canvas_assignment)
-                else:
-                    logging.info("     OK: Task is already up to date!")
-                    summary["up-to-date"].append(canvas_assignment)
+        # Only remember assignments whose commands were all applied
+        for assignment_id, task, content_hash, uuids in pending_states:
+            if all(sync_helper.is_ok(command_uuid) for command_uuid in uuids):
+                task_id = task["id"] if task is not None else None
+                self.sync_state.set(assignment_id, task_id, content_hash)
+        self.sync_state.commit()
 
         # Print out short summary
         logging.info("")
@@ -234,6 +361,7 @@ class CanvasToTodoist:
             notify(n_title, n_msg)
         else:
             logging.info("No new tasks added or updated. Skipping notification.")
+        return summary
 
         # Print detailed summary?
         # logging.info("")
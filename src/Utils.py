@@ -1,4 +1,5 @@
 import argparse
+import hashlib
 import logging
 import os
 import re
@@ -7,9 +8,11 @@ import appdirs
 from termcolor import colored
 
 
+appname = "CanvasSync"
+appauthor = "Andrei Cozma"
+
+
 def setup():
-    appname = "CanvasSync"
-    appauthor = "Andrei Cozma"
     os_save_path = appdirs.user_data_dir(appname, appauthor)
     os.makedirs(os_save_path, exist_ok=True)
     os_config_path = appdirs.user_config_dir(appname, appauthor)
@@ -21,6 +24,21 @@ def setup():
     return os_save_path, config_path, log_path
 
 
+def get_cache_path(file_name, api_key=None):
+    """
+    Returns a path in the user cache directory.
+    When an api_key is given, the file name is suffixed with a short hash of it
+    so that accounts sharing the machine don't share cached state.
+    """
+    os_cache_path = appdirs.user_cache_dir(appname, appauthor)
+    os.makedirs(os_cache_path, exist_ok=True)
+    if api_key is not None:
+        name, ext = os.path.splitext(file_name)
+        key_hash = hashlib.sha1(api_key.strip().encode("utf-8")).hexdigest()[:12]
+        file_name = f"{name}-{key_hash}{ext}"
+    return os.path.join(os_cache_path, file_name)
+
+
 def normalize_file_name(file_name, has_extension=True):
     rexp1 = r"%[0-9a-fA-F][0-9a-fA-F]"
     rexp2 = r"[\s+_\-:\\\/]+"
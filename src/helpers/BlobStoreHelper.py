@@ -0,0 +1,145 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ioctl request for cloning a file on btrfs/xfs (Linux only)
+FICLONE = 0x40049409
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = root
+        self.blobs_path = os.path.join(root, "blobs")
+        os.makedirs(self.blobs_path, exist_ok=True)
+        self.lock = threading.Lock()
+        # One instance can be shared by threads, e.g. the accounts of a batch;
+        # other processes using the store wait for the database instead of failing
+        self.db = sqlite3.connect(
+            os.path.join(root, "index.sqlite"), check_same_thread=False, timeout=30
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " file_id TEXT PRIMARY KEY, updated_at TEXT, size INTEGER, sha256 TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, sha256 TEXT)"
+        )
+        self.db.commit()
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_path, sha256[:2], sha256)
+
+    @staticmethod
+    def file_key(file_obj):
+        """
+        Canvas file ids are unique per instance, so the id alone (with updated_at and size
+        to detect new versions) identifies the content.
+        """
+        return str(file_obj["id"]), file_obj.get("updated_at"), file_obj.get("size")
+
+    def lookup_file(self, file_obj):
+        """
+        Returns the blob path holding this Canvas file, or None if it is not in the store
+        """
+        if "id" not in file_obj:
+            return None
+        file_id, updated_at, size = self.file_key(file_obj)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT updated_at, size, sha256 FROM files WHERE file_id = ?",
+                (file_id,),
+            ).fetchone()
+        if row is None or row[0] != updated_at or row[1] != size:
+            return None
+        return self._existing_blob(row[2])
+
+    def add_file(self, file_obj, path):
+        """
+        Moves a downloaded Canvas file into the store and links it back at path
+        """
+        sha256 = self.ingest(path)
+        if "id" in file_obj:
+            with self.lock:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                    (*self.file_key(file_obj), sha256),
+                )
+                self.db.commit()
+        return sha256
+
+    def lookup_url(self, url):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT sha256 FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+        return self._existing_blob(row[0]) if row is not None else None
+
+    def add_url(self, url, path):
+        sha256 = self.ingest(path)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO urls VALUES (?, ?)", (url, sha256))
+            self.db.commit()
+        return sha256
+
+    def _existing_blob(self, sha256):
+        blob_path = self.blob_path(sha256)
+        return blob_path if os.path.isfile(blob_path) else None
+
+    def ingest(self, path):
+        """
+        Stores the content of path under its hash, then replaces path with a link to the blob
+        """
+        sha256 = hash_file(path)
+        blob_path = self.blob_path(sha256)
+        if not os.path.isfile(blob_path):
+            # Link the new content into the store; the old link at path stays valid
+            self.link(path, blob_path)
+        else:
+            self.link(blob_path, path)
+        return sha256
+
+    @staticmethod
+    def link(src_path, path):
+        """
+        Places src_path at path as a hardlink, or a reflink/copy when hardlinks are not possible
+        """
+        if os.path.isfile(path) and os.path.samefile(src_path, path):
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.link"
+        try:
+            os.link(src_path, tmp_path)
+        except OSError:
+            # Different filesystem or no hardlink support
+            try:
+                _reflink(src_path, tmp_path)
+            except OSError:
+                shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+
+
+def _reflink(src_path, dst_path):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(dst_path)
+            raise
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class RequestBudget:
+    def __init__(self, path=None, limit=1000, window=15 * 60, reserve=100):
+        """
+        Counts requests in a sliding window of `window` seconds, persisted to `path`
+        so runs started in short succession, or at the same time, share the same count.
+        The last `reserve` requests of the window are kept for high priority writes.
+        """
+        self.path = path
+        self.limit = limit
+        self.window = window
+        self.reserve = reserve
+        self.lock = threading.Lock()
+        self.timestamps = []
+        self.num_spent = 0
+        self._load()
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        Serializes updates of the budget file with other runs, and other accounts of a batch
+        """
+        if self.path is None or fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.timestamps = json.load(f)
+        except (OSError, ValueError):
+            self.timestamps = []
+        self._prune()
+
+    def _save(self):
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.timestamps, f)
+        os.replace(tmp_path, self.path)
+
+    def _prune(self):
+        cutoff = time.time() - self.window
+        self.timestamps = [t for t in self.timestamps if t > cutoff]
+
+    def remaining(self):
+        with self.lock:
+            self._load()
+            self._prune()
+            return self.limit - len(self.timestamps)
+
+    def is_low(self, needed=1):
+        """
+        True if spending `needed` more requests would dip into the reserve
+        """
+        return self.remaining() - needed < self.reserve
+
+    def wait_time(self):
+        """
+        Seconds until a request can be sent without exceeding the limit
+        """
+        with self.lock:
+            self._load()
+            self._prune()
+            return self._wait_time()
+
+    def _wait_time(self):
+        if len(self.timestamps) < self.limit:
+            return 0
+        return self.timestamps[-self.limit] + self.window - time.time()
+
+    def spend(self, max_wait=60):
+        """
+        Records a request, first waiting up to max_wait seconds for room in the window.
+        Returns False, without recording, if the window stays full for longer.
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            # Check and record in one step, so concurrent runs can't both take the last slot
+            with self.lock, self._file_lock():
+                self._load()
+                self._prune()
+                wait = self._wait_time()
+                if wait <= 0:
+                    self.timestamps.append(time.time())
+                    self.num_spent += 1
+                    self._save()
+                    return True
+            if time.monotonic() + wait > deadline:
+                return False
+            logging.info(f"  - Todoist request budget used up, waiting {round(wait)}s")
+            time.sleep(wait)
+
+    def log_stats(self):
+        logging.info(
+            f"# Todoist requests: {self.num_spent} this run, "
+            f"{self.limit - self.remaining()}/{self.limit} in the last "
+            f"{round(self.window / 60)} minutes"
+        )
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Response headers kept alongside cached bodies (pagination needs `Link`)
+STORED_HEADERS = ["Content-Type", "Link", "ETag", "Last-Modified"]
+
+
+class HttpCache:
+    def __init__(self, cache_path, max_size_mb=64):
+        self.cache_path = cache_path
+        self.max_size = int(max_size_mb * 1000000)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(cache_path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, url TEXT, etag TEXT, last_modified TEXT,"
+            " headers TEXT, body BLOB, size INTEGER, accessed REAL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self.db.commit()
+        self.size = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    @staticmethod
+    def make_key(url, headers=None, params=None):
+        """
+        Cache key for a request: the URL, the sorted query params and the
+        credentials, so that different accounts never share entries.
+        """
+        auth = (headers or {}).get("Authorization", "")
+        params = sorted((str(k), str(v)) for k, v in (params or {}).items())
+        raw = json.dumps([url, params, auth])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, url, headers=None, params=None, timeout=10, get=requests.get):
+        """
+        Sends a conditional GET request.
+        Returns the live response, or the cached body as a 200 response if the server answers 304.
+        """
+        key = self.make_key(url, headers, params)
+        entry = self._lookup(key)
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            etag, last_modified = entry[0], entry[1]
+            if etag:
+                request_headers["If-None-Match"] = etag
+            if last_modified:
+                request_headers["If-Modified-Since"] = last_modified
+
+        response = get(url, headers=request_headers, params=params, timeout=timeout)
+
+        if response.status_code == 304 and entry is not None:
+            self.hits += 1
+            self._touch(key)
+            return self._make_response(response, entry)
+
+        self.misses += 1
+        if response.status_code == 200 and (
+            "ETag" in response.headers or "Last-Modified" in response.headers
+        ):
+            self._store(key, url, response)
+        return response
+
+    def _lookup(self, key):
+        with self.lock:
+            return self.db.execute(
+                "SELECT etag, last_modified, headers, body FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+    def _touch(self, key):
+        with self.lock:
+            self.db.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+            self.db.commit()
+
+    def _store(self, key, url, response):
+        body = response.content
+        if len(body) > self.max_size:
+            return
+        headers = {
+            h: response.headers[h] for h in STORED_HEADERS if h in response.headers
+        }
+        with self.lock:
+            old = self.db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if old is not None:
+                self.size -= old[0]
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    url,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    json.dumps(headers),
+                    body,
+                    len(body),
+                    time.time(),
+                ),
+            )
+            self.size += len(body)
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        # Drop the least recently used entries until the cache fits its budget
+        while self.size > self.max_size:
+            row = self.db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT 1"
+            ).fetchone()
+            if row is None:
+                self.size = 0
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self.size -= row[1]
+            self.evictions += 1
+
+    @staticmethod
+    def _make_response(not_modified, entry):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK (cached)"
+        response.url = not_modified.url
+        response.request = not_modified.request
+        response.headers = CaseInsensitiveDict(json.loads(entry[2]))
+        response.encoding = "utf-8"
+        response._content = entry[3]
+        return response
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = round(100 * self.hits / total) if total else 0
+        logging.info(
+            f"# HTTP cache: {self.hits} hits, {self.misses} misses ({hit_rate}% hit rate), "
+            f"{self.evictions} evictions, {round(self.size / 1000000, 2)} MB stored"
+        )
@@ -2,186 +2,215 @@ import hashlib
 import json
 import logging
 import os
-import re
+import threading
 import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import requests
-from bs4 import BeautifulSoup
 from termcolor import colored
 
+from src.helpers.BlobStoreHelper import BlobStore
+from src.helpers.HtmlHelper import image_name, localize_images
+from src.helpers.TransportHelper import CanvasTransport
 from src.Utils import normalize_file_name, p_info
 
 
 class CanvasDownloadHelper:
-    def __init__(self, api_key, canvas_api_heading="https://canvas.instructure.com"):
+    def __init__(
+        self,
+        api_key,
+        canvas_api_heading="https://canvas.instructure.com",
+        transport=None,
+        chunk_size=1024 * 1024,
+        segment_threshold=100 * 1000000,
+        segment_connections=4,
+        blob_store=None,
+        html_engine="fast",
+        html_workers=0,
+        image_workers=4,
+    ):
         self.canvas_api_heading = canvas_api_heading
+        self.chunk_size = chunk_size
+        # Files of at least segment_threshold bytes are fetched as parallel byte ranges
+        self.segment_threshold = segment_threshold
+        self.segment_connections = segment_connections
+        # Content-addressed store that course files and images are linked from
+        self.blob_store = blob_store
+        # Page rewriting is CPU-bound; html_workers > 0 runs it on a process pool
+        self.html_engine = html_engine
+        self.html_workers = html_workers
+        self._html_pool = None
+        # Images of one page are fetched on up to image_workers threads; the url -> local
+        # path cache and failed urls are shared by every page of the run, see start_run
+        self.image_workers = image_workers
+        self._image_paths = {}
+        self._failed_images = set()
+        # Called with the size of every written chunk, e.g. for progress and bandwidth limits
+        self.on_chunk = None
+        self._file_locks = {}
+        self._file_locks_lock = threading.Lock()
+        self.transport = transport or CanvasTransport(api_key, canvas_api_heading)
         self.header = {"Authorization": f"Bearer {api_key.strip()}"}
         p_info("# CanvasDownloadHelper: Initialized")
         logging.info(f"  - Canvas API Heading: {self.canvas_api_heading}")
         logging.info(colored(f"  - Header: {self.header}", "grey"))
 
-    def download_course_files(self, course_id, save_path, param=None):
-        if param is None:
-            param = {}
-        response = requests.get(
-            f"{self.canvas_api_heading}/api/v1/courses/{str(course_id)}/folders",
-            headers=self.header,
-            params=param,
-        )
-
-        if response.status_code != 200:
-            logging.info(colored(f"  - Error: {response.status_code}", "red"))
-            return False
-
-        num_files = 0
-        for folder in response.json():
-            folder_name = folder["full_name"]
-            # Replace +, _, -, and spaces with -
-            folder_name = re.sub(r"[\s+_\-:\.]+", "-", folder_name)
-
-            folder_path = os.path.join(save_path, folder_name.lower())
-            os.makedirs(folder_path, exist_ok=True)
-
-            folder_files_url = folder["files_url"]
-            folder_files_response = requests.get(
-                folder_files_url, headers=self.header, params=param
-            )
-
-            reason_clean = folder_files_response.reason.replace(" ", "-")
-            reason_clean = f".canvas-sync-{reason_clean}"
-
-            with open(os.path.join(folder_path, f"{reason_clean}.json"), "w") as f:
-                json.dump(folder_files_response.json(), f, indent=4)
-
-            if folder_files_response.status_code != 200:
+    def _get(self, url, param=None):
+        """
+        GET request for Canvas API JSON, revalidated against the HTTP cache
+        """
+        return self.transport.get(url, param, use_cache=True)
+
+    def run_job(self, job):
+        """
+        Downloads a file or page discovered by the crawler. Returns True if anything was written.
+        """
+        try:
+            if self.is_current(job):
                 logging.info(
-                    colored(
-                        f"  * Folder: `{folder_name}` => "
-                        f"{folder_files_response.status_code} - {folder_files_response.reason}",
-                        "red",
-                    )
+                    colored(f"    - Skipping `{job['name']}` (unchanged)", "yellow")
                 )
-                continue
-
-            folders_count = folder["folders_count"]
-            files_count = folder["files_count"]
-            logging.info(
-                f" * Folder `{folder_name}` (Folders: {folders_count}, Files: {files_count})"
-            )
+                return False
+            if job["type"] == "html":
+                return self.download_html_helper(
+                    job["name"],
+                    job["body"],
+                    job["folder_path"],
+                    job.get("page_index"),
+                    job.get("localized"),
+                )
+            file_obj = job["file_obj"]
+            manifest = job.get("manifest")
+            tracked = manifest is not None and "id" in file_obj
 
-            for file in folder_files_response.json():
-                try:
-                    if self.download_file_handler(
-                        file["display_name"], file["url"], file, folder_path
-                    ):
-                        num_files += 1
-                except Exception as e:
-                    logging.info(colored(f"  - Error: {e}", "red"))
-                    logging.info(json.dumps(file, indent=4))
-                    logging.info(json.dumps(folder, indent=4))
-                    continue
-
-        return num_files
-
-    def download_module_files(self, course_id, save_path, param=None):
-        if param is None:
-            param = {}
-
-        response = requests.get(
-            f"{self.canvas_api_heading}/api/v1/courses/{str(course_id)}/modules",
-            headers=self.header,
-            params=param,
-        )
+            # The same file is often listed in both Files and Modules; let one job fetch it
+            with self._get_file_lock(file_obj.get("id")):
+                if tracked and self.is_current(job):
+                    return False
+                # Without a manifest entry, a file of the same size may still be
+                # an older version, so it is downloaded again
+                downloaded = self.download_file_handler(
+                    job["name"],
+                    job["url"],
+                    file_obj,
+                    job["folder_path"],
+                    job["subfolder_name"],
+                    trust_size=not tracked,
+                )
 
-        if response.status_code != 200:
-            logging.info(colored(f"  - Error: {response.status_code}", "red"))
+            # Record the copy the handler used: the folder's, else the subfolder's
+            saved_paths = [
+                path
+                for path in self._saved_paths(job)
+                if os.path.isfile(path) and not os.path.isfile(f"{path}.part")
+            ]
+            if tracked and saved_paths:
+                manifest.record(file_obj, saved_paths[0])
+            return downloaded
+        except Exception as e:
+            logging.info(colored(f"  - Error: {e}", "red"))
+            traceback.print_exc()
+            logging.info(json.dumps(job.get("file_obj", job.get("name")), indent=4))
             return False
 
-        save_path = os.path.join(save_path, "course-files")
-
-        num_files = 0
-        for module in response.json():
-            module_name = module["name"]
-            # Replace +, _, -, and spaces with -
-            module_name = re.sub(r"[\s+_\-:\.]+", "-", module_name)
+    @staticmethod
+    def is_current(job):
+        """
+        True if the manifest or page index shows a crawler job is already downloaded
+        """
+        if job["type"] == "html":
+            page_index = job.get("page_index")
+            file_path = os.path.join(
+                job["folder_path"], normalize_file_name(f"{job['name']}.html")
+            )
+            return page_index is not None and page_index.is_current(
+                file_path, job["body"]
+            )
+        manifest = job.get("manifest")
+        if manifest is None:
+            return False
+        return any(
+            manifest.is_current(job["file_obj"], path)
+            for path in CanvasDownloadHelper._saved_paths(job)
+        )
 
-            logging.info(f" * Module: `{module_name}`")
-            items_url = module["items_url"]
-            items_url_response = requests.get(
-                items_url, headers=self.header, params=param
+    @staticmethod
+    def _saved_paths(job):
+        """
+        The paths a file job may be saved to: in its folder, or else in its subfolder
+        """
+        file_name = normalize_file_name(job["name"])
+        paths = [os.path.join(job["folder_path"], file_name)]
+        if job.get("subfolder_name") is not None:
+            paths.append(
+                os.path.join(job["folder_path"], job["subfolder_name"], file_name)
+            )
+        return paths
+
+    def _write_chunks(self, r, f):
+        written = 0
+        for chunk in r.iter_content(chunk_size=self.chunk_size):
+            if chunk:
+                if self.on_chunk is not None:
+                    self.on_chunk(len(chunk))
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
+    def _get_html_pool(self):
+        with self._file_locks_lock:
+            if self._html_pool is None:
+                self._html_pool = ProcessPoolExecutor(max_workers=self.html_workers)
+            return self._html_pool
+
+    def prepare_job(self, job):
+        """
+        Called when a job is queued: with html_workers, the page is rewritten on the
+        process pool while it waits for a download worker
+        """
+        if job["type"] == "html" and self.html_workers > 0:
+            job["localized"] = self._get_html_pool().submit(
+                localize_images, job["body"], self.html_engine
             )
 
-            for item in items_url_response.json():
-                file_type = item["type"]
-                if file_type.lower() != "file":
-                    folder_path = os.path.join(save_path, module_name.lower())
-                else:
-                    folder_path = save_path
-
-                # if file_type != "File":
-                if "url" not in item:
-                    logging.info(colored(f"    - {file_type} - Skipping", "yellow"))
-                    continue
-
-                html_url = item["url"]
-                html_url_response = requests.get(html_url, headers=self.header)
-                html_url_response_json = html_url_response.json()
-
-                # pprint(item)
-                # pprint(html_url_response_json)
-                try:
-                    if file_type.lower() == "file":
-                        file_name = html_url_response_json["display_name"]
-                        file_url = html_url_response_json["url"]
-                        if self.download_file_handler(
-                            file_name,
-                            file_url,
-                            html_url_response_json,
-                            folder_path,
-                            module_name.lower(),
-                        ):
-                            num_files += 1
-                        continue
-
-                    if file_type.lower() == "externaltool":
-                        file_name = html_url_response_json["name"]
-                        body = json.dumps(item, indent=4)
-                        with open(
-                            os.path.join(folder_path, f"{file_name}.json"), "w"
-                        ) as f:
-                            f.write(body)
-                        continue
-
-                    if file_type.lower() == "page":
-                        file_name = html_url_response_json["title"]
-                        body = html_url_response_json["body"]
-                    elif file_type.lower() == "assignment":
-                        file_name = html_url_response_json["name"]
-                        body = html_url_response_json["description"]
-                    elif file_type.lower() == "quiz":
-                        file_name = html_url_response_json["title"]
-                        body = html_url_response_json["description"]
-                    elif file_type.lower() == "discussion":
-                        file_name = html_url_response_json["title"]
-                        body = html_url_response_json["message"]
-
-                    else:
-                        raise Exception(f"Unknown file type: {file_type}")
-
-                    if self.download_html_helper(file_name, body, folder_path):
-                        num_files += 1
-                except Exception as e:
-                    logging.info(colored(f"    - {file_type} - Error: {e}", "red"))
-                    traceback.print_exc()
-                    logging.info(json.dumps(item, indent=4))
-                    logging.info(json.dumps(html_url_response_json, indent=4))
-                    continue
-
-        return num_files
+    def start_run(self):
+        """
+        Forgets the images fetched or failed in a previous run, e.g. of a daemon,
+        so failed images are retried and deleted copies are not linked from
+        """
+        self._image_paths = {}
+        self._failed_images = set()
+
+    def close(self):
+        """
+        Ends a run: drops the per-path locks that are no longer held, and stops the
+        page rewriting processes; they are started again when needed
+        """
+        with self._file_locks_lock:
+            self._file_locks = {
+                key: lock for key, lock in self._file_locks.items() if lock.locked()
+            }
+            html_pool, self._html_pool = self._html_pool, None
+        if html_pool is not None:
+            html_pool.shutdown(wait=True, cancel_futures=True)
+
+    def _get_file_lock(self, file_id):
+        with self._file_locks_lock:
+            return self._file_locks.setdefault(file_id, threading.Lock())
 
     def download_file_handler(
-        self, file_name, file_url, file_obj, folder_path, subfolder_name=None
+        self,
+        file_name,
+        file_url,
+        file_obj,
+        folder_path,
+        subfolder_name=None,
+        trust_size=True,
     ):
+        """
+        Saves a file, linked from the blob store if it is there. With trust_size, an
+        existing file of the same size is kept; without it, it is downloaded again.
+        """
         os.makedirs(folder_path, exist_ok=True)
         file_name = normalize_file_name(file_name)
         file_path = os.path.join(folder_path, file_name)
@@ -197,18 +226,38 @@ class CanvasDownloadHelper:
                     file_url,
                     file_obj,
                     os.path.join(folder_path, subfolder_name),
+                    trust_size=trust_size,
+                )
+
+            blob_path = (
+                self.blob_store.lookup_file(file_obj)
+                if self.blob_store is not None
+                else None
+            )
+            if blob_path is not None:
+                # Already downloaded for another folder, course or semester
+                if os.path.isfile(file_path) and os.path.samefile(blob_path, file_path):
+                    logging.info(
+                        colored(f"    - Skipping `{file_name}` (in store)", "yellow")
+                    )
+                    return False
+                logging.info(
+                    colored(f"    - Linking `{file_name}` from store", "green")
                 )
+                self.blob_store.link(blob_path, file_path)
+                return True
 
             if os.path.isfile(file_path):
                 # Get size in bytes of filepath
                 existing_size = os.path.getsize(file_path)
-                if existing_size == file_size:
+                if trust_size and existing_size == file_size:
                     logging.info(
                         colored(
                             f"    - Skipping `{file_name}` (size: {file_size} bytes, existing_size: {existing_size} bytes)",
                             "yellow",
                         )
                     )
+                    # Only a size match: the copy may be outdated, so keep it out of the store
                     return False
                 logging.info(
                     colored(
@@ -239,76 +288,315 @@ class CanvasDownloadHelper:
 
             return False
 
-        r = requests.get(file_url, stream=True, headers=self.header)
-        with open(file_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
+        if not self.download_file(file_url, file_path, file_obj.get("size")):
+            return False
+        if self.blob_store is not None:
+            self.blob_store.add_file(file_obj, file_path)
+        return True
+
+    def download_file(self, file_url, file_path, file_size=None):
+        """
+        Downloads into `<file_path>.part`, resuming a previous partial download with a
+        Range request when possible, and renames it into place once it is complete.
+        Returns False if the download failed or does not match file_size.
+        """
+        with self._get_file_lock(file_path):
+            return self._download_file(file_url, file_path, file_size)
+
+    def _download_file(self, file_url, file_path, file_size=None):
+        part_path = f"{file_path}.part"
+        if (
+            file_size is not None
+            and self.segment_connections > 1
+            and file_size >= self.segment_threshold
+        ):
+            downloaded = self.download_file_segmented(file_url, file_path, file_size)
+            if downloaded is not None:
+                return downloaded
+
+        segments_path = f"{part_path}.segments"
+        if os.path.isfile(segments_path):
+            # A preallocated part file from a segmented download can't be resumed as a stream
+            os.remove(segments_path)
+            if os.path.isfile(part_path):
+                os.remove(part_path)
+
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        if file_size is not None and offset > file_size:
+            offset = 0
+
+        # Ask for the raw bytes so the stream length matches the Canvas file size
+        headers = {"Accept-Encoding": "identity"}
+        if offset > 0:
+            headers["Range"] = f"bytes={offset}-"
+        r = self.transport.get(file_url, stream=True, headers=headers)
+
+        if offset > 0 and r.status_code == 416 and offset == file_size:
+            # The partial file already holds every byte
+            r.close()
+        elif r.status_code in (200, 206):
+            if offset > 0 and r.status_code == 206:
+                logging.info(f"      - Resuming from byte {offset}")
+                mode = "ab"
+            else:
+                # The server ignored the Range header and sent the whole file
+                mode = "wb"
+            with open(part_path, mode) as f:
+                self._write_chunks(r, f)
+        else:
+            logging.info(colored(f"      - Error: {r.status_code} - {r.reason}", "red"))
+            r.close()
+            return False
+
+        downloaded_size = os.path.getsize(part_path)
+        if file_size is not None and downloaded_size != file_size:
+            logging.info(
+                colored(
+                    f"      - Incomplete download ({downloaded_size}/{file_size} bytes), "
+                    "will resume on the next run",
+                    "red",
+                )
+            )
+            return False
+
+        os.replace(part_path, file_path)
+        return True
+
+    def download_file_segmented(self, file_url, file_path, file_size):
+        """
+        Downloads a large file as byte ranges over several pooled connections, writing
+        each range at its offset in a preallocated `<file_path>.part`.
+        Completed ranges are recorded in `<file_path>.part.segments` so an interrupted
+        download only fetches the missing ones.
+        Returns None if the server does not honor Range requests.
+        """
+        part_path = f"{file_path}.part"
+        segments_path = f"{part_path}.segments"
+
+        probe = self.transport.get(
+            file_url,
+            stream=True,
+            headers={"Accept-Encoding": "identity", "Range": "bytes=0-0"},
+        )
+        probe.close()
+        content_range = probe.headers.get("Content-Range", "")
+        if probe.status_code != 206 or not content_range.endswith(f"/{file_size}"):
+            logging.info("      - Server does not support ranges, using one stream")
+            return None
+
+        segment_size = -(-file_size // self.segment_connections)
+        segments = [
+            [start, min(start + segment_size, file_size) - 1]
+            for start in range(0, file_size, segment_size)
+        ]
+
+        done = self._load_segments_state(segments_path, part_path, file_size, segments)
+        if done is None:
+            # No usable resume state: start over with an empty, preallocated file
+            done = set()
+            with open(part_path, "wb") as f:
+                f.truncate(file_size)
+
+        logging.info(
+            f"      - Segmented download: {len(segments)} ranges, "
+            f"{len(segments) - len(done)} remaining"
+        )
+        lock = threading.Lock()
 
+        def fetch_segment(index):
+            start, end = segments[index]
+            try:
+                r = self.transport.get(
+                    file_url,
+                    stream=True,
+                    headers={
+                        "Accept-Encoding": "identity",
+                        "Range": f"bytes={start}-{end}",
+                    },
+                )
+                if r.status_code != 206:
+                    r.close()
+                    return False
+                with open(part_path, "r+b") as f:
+                    f.seek(start)
+                    written = self._write_chunks(r, f)
+            except (requests.RequestException, OSError) as e:
+                logging.info(colored(f"      - Range {start}-{end}: {e}", "red"))
+                return False
+            if written != end - start + 1:
+                return False
+            with lock:
+                done.add(index)
+                # Replace the sidecar atomically, so an interruption can't leave it partial
+                tmp_path = f"{segments_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump({"segments": segments, "done": sorted(done)}, f)
+                os.replace(tmp_path, segments_path)
+            return True
+
+        remaining = [i for i in range(len(segments)) if i not in done]
+        with ThreadPoolExecutor(max_workers=self.segment_connections) as executor:
+            results = list(executor.map(fetch_segment, remaining))
+
+        if not all(results):
+            logging.info(
+                colored(
+                    f"      - Incomplete download ({len(done)}/{len(segments)} ranges), "
+                    "will resume on the next run",
+                    "red",
+                )
+            )
+            return False
+
+        os.remove(segments_path)
+        os.replace(part_path, file_path)
         return True
 
-    def download_html_helper(self, file_name, body, folder_path):
+    @staticmethod
+    def _load_segments_state(segments_path, part_path, file_size, segments):
+        """
+        Returns the indexes of the ranges already downloaded into part_path, or None if
+        there is no usable resume state; a corrupt sidecar is treated like a missing one
+        """
+        if not (
+            os.path.isfile(segments_path)
+            and os.path.isfile(part_path)
+            and os.path.getsize(part_path) == file_size
+        ):
+            return None
+        try:
+            with open(segments_path) as f:
+                state = json.load(f)
+            if state["segments"] != segments:
+                raise ValueError("the ranges have changed")
+            done = {int(index) for index in state["done"]}
+            if not done <= set(range(len(segments))):
+                raise ValueError("unknown ranges")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.info(
+                colored(f"      - Discarding resume state ({e}), starting over", "red")
+            )
+            os.remove(segments_path)
+            os.remove(part_path)
+            return None
+        return done
+
+    def fetch_image(self, img_url, img_path, label=""):
+        """
+        Saves an image of a page to img_path. Images already fetched in this run, or
+        found in the blob store, are linked instead of downloaded, and urls that failed
+        are not tried again until the next run. Returns True if img_path exists.
+        """
+        try:
+            with self._get_file_lock(("url", img_url)):
+                if img_url in self._failed_images:
+                    return False
+                src_path = self._image_paths.get(img_url)
+                if src_path is None and self.blob_store is not None:
+                    # Shared with other pages, possibly in other courses
+                    src_path = self.blob_store.lookup_url(img_url)
+                if src_path is not None and os.path.isfile(src_path):
+                    if not (
+                        os.path.isfile(img_path)
+                        and os.path.samefile(src_path, img_path)
+                    ):
+                        BlobStore.link(src_path, img_path)
+                    self._image_paths[img_url] = src_path
+                    return True
+
+                if os.path.isfile(img_path):
+                    logging.info(
+                        colored(f"       - Skipping image {label}: {img_url}", "yellow")
+                    )
+                    self._image_paths[img_url] = img_path
+                    return True
+
+                logging.info(
+                    colored(f"       - Downloading image {label}: {img_url}", "green")
+                )
+                if not self.download_file(img_url, img_path):
+                    self._failed_images.add(img_url)
+                    return False
+                if self.blob_store is not None:
+                    self.blob_store.add_url(img_url, img_path)
+                self._image_paths[img_url] = img_path
+                return True
+        except Exception as e:
+            logging.info(colored(f"       - Image {img_url}: {e}", "red"))
+            self._failed_images.add(img_url)
+            return False
+
+    def download_html_helper(
+        self, file_name, body, folder_path, page_index=None, localized=None
+    ):
+        """
+        Saves a page with its images. With a page_index, a page whose Canvas body is
+        unchanged is skipped before parsing, and a changed one is written without
+        comparing it to the existing file. Only the img tags of the page are rewritten.
+        localized is a future of the rewritten page, started by prepare_job.
+        """
         os.makedirs(folder_path, exist_ok=True)
         file_name = normalize_file_name(f"{file_name}.html")
         file_path = os.path.join(folder_path, file_name)
 
         logging.info(f"    - `{file_name}`")
-        # Use beautiful soup to parse the html and download any images and files
-        soup = BeautifulSoup(body, "html.parser")
+        if page_index is not None and os.path.isfile(file_path):
+            if page_index.is_current(file_path, body):
+                logging.info(
+                    colored(f"       => Skipping `{file_name}` (unchanged)", "yellow")
+                )
+                return False
+            known_page = page_index.get(file_path) is not None
+        else:
+            known_page = False
+        # Point the images at local copies; the rewrite may already run in another process
+        if localized is not None:
+            html, img_urls = localized.result()
+        else:
+            html, img_urls = localize_images(body, self.html_engine)
 
         folder_img = os.path.join(folder_path, "img")
         folder_res = os.path.join(folder_path, "res")
         os.makedirs(folder_img, exist_ok=True)
         os.makedirs(folder_res, exist_ok=True)
 
-        all_imgs = soup.find_all("img")
-        len_all_imgs = len(all_imgs) if all_imgs is not None else 0
-        for i, img in enumerate(all_imgs):
-            # pprint(img)
-            if "src" in img.attrs:
-                img_url = img.attrs["src"]
-                if img_url.startswith("http"):
-                    # create a hash of the url to use as the filename
-                    img_name = hashlib.md5(img_url.encode("utf-8")).hexdigest()
-                    # save to res folder
-                    img_path = os.path.join(folder_img, img_name)
-                    if not os.path.isfile(img_path):
-                        logging.info(
-                            colored(
-                                f"       - Downloading image {i + 1}/{len_all_imgs}: {img_url}",
-                                "green",
-                            )
-                        )
-                        r = requests.get(img_url, stream=True, headers=self.header)
-                        with open(img_path, "wb") as f:
-                            for chunk in r.iter_content(chunk_size=1024):
-                                if chunk:
-                                    f.write(chunk)
-                    else:
-                        logging.info(
-                            colored(
-                                f"       - Skipping image {i + 1}/{len_all_imgs}: {img_url}",
-                                "yellow",
-                            )
-                        )
-                    # read the file back in, get the actual hash of the content, and move it to the correct name
-                    # with open(img_path, "rb") as f:
-                    #     img_name = hashlib.md5(f.read()).hexdigest()
-                    # os.rename(img_path, os.path.join(folder_img, img_name))
-                    img.attrs["src"] = f"./img/{img_name}"
+        # Fetch the images of the page concurrently, each distinct url at most once per run
+        img_urls = list(dict.fromkeys(img_urls))
+        images_ok = True
+        if img_urls:
+            with ThreadPoolExecutor(
+                max_workers=min(len(img_urls), self.image_workers)
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        self.fetch_image,
+                        img_url,
+                        os.path.join(folder_img, image_name(img_url)),
+                        f"{i + 1}/{len(img_urls)}",
+                    )
+                    for i, img_url in enumerate(img_urls)
+                ]
+            images_ok = all(future.result() for future in futures)
+        # A page is only recorded as current once all of its images are saved,
+        # so the next run fetches the missing ones again
+        record_page = page_index is not None and images_ok
+        if page_index is not None and not images_ok:
+            logging.info(
+                colored(
+                    f"       => Missing images, `{file_name}` will be retried", "red"
+                )
+            )
 
-        if os.path.isfile(file_path):
+        if known_page:
+            logging.info(colored(f"       => Updating `{file_name}`", "green"))
+        elif os.path.isfile(file_path):
             # existing_size = os.path.getsize(file_path)
             # read the existing file
             with open(file_path, "r") as f:
-                existing_soup = BeautifulSoup(f.read(), "html.parser")
-            existing_hash = hashlib.md5(
-                existing_soup.prettify().encode("utf-8")
-            ).hexdigest()
+                existing_hash = hashlib.md5(f.read().encode("utf-8")).hexdigest()
 
-            curr_hash = hashlib.md5(soup.prettify().encode("utf-8")).hexdigest()
+            curr_hash = hashlib.md5(html.encode("utf-8")).hexdigest()
 
-            # curr_size = len(soup.prettify())
             if existing_hash == curr_hash:
                 logging.info(
                     colored(
@@ -316,6 +604,8 @@ class CanvasDownloadHelper:
                         "yellow",
                     )
                 )
+                if record_page:
+                    page_index.record(file_path, body)
                 return False
             else:
                 logging.info(
@@ -328,6 +618,8 @@ class CanvasDownloadHelper:
             logging.info(colored(f"       => Downloading `{file_name}`", "green"))
 
         with open(file_path, "w") as f:
-            f.write(soup.prettify())
+            f.write(html)
+        if record_page:
+            page_index.record(file_path, body)
 
         return True
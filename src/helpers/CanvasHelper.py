@@ -1,29 +1,61 @@
+import json
 import logging
-from operator import itemgetter
+import os
+import re
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from operator import itemgetter
 
-import requests
-from canvasapi import Canvas
-from pick import pick
 from termcolor import colored
 
 from src.helpers.CanvasDownloadHelper import CanvasDownloadHelper
+from src.helpers.CrawlHelper import CanvasCrawler
 from src.helpers.LogHelper import notify
+from src.helpers.ManifestHelper import DownloadManifest, PageHashIndex
+from src.helpers.SchedulerHelper import DownloadScheduler
+from src.helpers.TransportHelper import CanvasRequestError, CanvasTransport
 from src.Utils import normalize_file_name, p_info
 
 
 class CanvasHelper:
     def __init__(
-        self, api_key, canvas_api_heading: str = "https://canvas.instructure.com"
+        self,
+        api_key,
+        canvas_api_heading: str = "https://canvas.instructure.com",
+        max_workers: int = 8,
+        transport=None,
+        download_options=None,
+        scheduler_options=None,
+        catalog_path=None,
+        catalog_ttl=24 * 3600,
     ):
         self.api_key = api_key
         self.canvas_api_heading = canvas_api_heading
         self.header = {"Authorization": f"Bearer {api_key.strip()}"}
         p_info("# CanvasHelper: Initialized")
+        self.max_workers = max_workers
         logging.info(f"  - Canvas API Heading: {self.canvas_api_heading}")
+        logging.info(f"  - Max Workers: {self.max_workers}")
         logging.info(colored(f"  - Header: {self.header}", "grey"))
-        self.download_helper = CanvasDownloadHelper(api_key, canvas_api_heading)
+        # All Canvas traffic shares one pooled keep-alive session
+        self.transport = transport or CanvasTransport(api_key, canvas_api_heading)
+        self.download_helper = CanvasDownloadHelper(
+            api_key,
+            canvas_api_heading,
+            transport=self.transport,
+            **(download_options or {}),
+        )
+        # Worker count, ordering policy and bandwidth cap of the download stage
+        self.scheduler_options = dict(
+            {"max_workers": max_workers}, **(scheduler_options or {})
+        )
+        self.courses = {}
         self.courses_id_name_dict = {}
+        # Cached course catalog, used by course_rules for up to catalog_ttl seconds
+        self.catalog_path = catalog_path
+        self.catalog_ttl = catalog_ttl
 
     @staticmethod
     def get_course_names(course_ids):
@@ -39,110 +71,269 @@ class CanvasHelper:
     def get_assignments(self, course_ids, param):
         """
         Iterates over the selected_course_ids list and loads all the users assignments for those classes.
-        Appends assignment objects to assignments list.
+        All courses, and all pages within a course, are fetched concurrently.
+        Returns the assignments in course order, then page order.
+        Courses that could not be loaded completely are left out.
         """
         logging.info("# Loading assignments from Canvas")
-        assignments = []
-        for course_id in course_ids:
-            response = requests.get(
-                f"{self.canvas_api_heading}/api/v1/courses/{str(course_id)}/assignments",
-                headers=self.header,
-                params=param,
-                timeout=10,
-            )
-
-            # if response.status_code == 401:
-            #     logging.info("Unauthorized! Check Canvas API Key")
-            #     exit()
-            # assignments.extend(iter(response.json()))
-
-            if response.status_code == 200:
-                assignments.extend(iter(response.json()))
-            else:
-                logging.error(
-                    f"Error: {response.status_code} - {response.reason} - {response.text}"
-                )
-                notify(
-                    "Error",
-                    f"Got Status Code {response.status_code} for Course ID {course_id}",
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            course_futures = [
+                executor.submit(
+                    self.transport.get_paginated,
+                    f"{self.canvas_api_heading}/api/v1/courses/{str(course_id)}/assignments",
+                    param,
+                    executor,
                 )
+                for course_id in course_ids
+            ]
+            assignments = []
+            for course_id, future in zip(course_ids, course_futures):
+                pages, status = future.result()
+                course_assignments = []
+                try:
+                    for page_future in pages:
+                        course_assignments.extend(page_future.result())
+                except CanvasRequestError as e:
+                    status = e.status_code
+                if status is not None:
+                    # Leave the course out rather than act on part of its assignments
+                    logging.error(
+                        f"Error: Could not load all assignments of course {course_id}, skipping it"
+                    )
+                    notify(
+                        "Error",
+                        f"Got Status Code {status} for Course ID {course_id}",
+                    )
+                    continue
+                assignments.extend(course_assignments)
 
         return assignments
 
-    def download_course_files_all(self, course_ids, param):
+    def download_files_all(self, course_ids, param, dry_run=False):
+        """
+        Crawls the Files and Modules of all courses concurrently and hands every discovered
+        file and page to a download scheduler. With dry_run, only logs what would be downloaded.
+        Returns the number of files downloaded.
+        """
         logging.info(
-            colored("# Downloading Folders & Files", attrs=["bold", "reverse"])
+            colored("# Downloading Folders, Files & Modules", attrs=["bold", "reverse"])
         )
-        for course_id, c_obj in course_ids.items():
-            c_name = c_obj["name"]
-            logging.info(colored(f"# Course: {c_name} - Files", attrs=["bold"]))
-            save_path = c_obj["save_path"]
-            num_files = self.download_helper.download_course_files(
-                course_id, save_path, param
-            )
-            logging.info(f" => Course: {c_name} - Files - Downloaded {num_files} files")
-            if num_files > 0:
-                notify(f"{c_name} - Files", f"Downloaded {num_files} files")
+        crawler = CanvasCrawler(
+            self.transport,
+            self.canvas_api_heading,
+            max_workers=self.max_workers,
+            dry_run=dry_run,
+        )
+        # Skip files whose recorded updated_at and size still match Canvas,
+        # and pages whose body hashes the same as when they were saved
+        manifests = {
+            course_id: DownloadManifest(c_obj["save_path"])
+            for course_id, c_obj in course_ids.items()
+        }
+        page_indexes = {
+            course_id: PageHashIndex(c_obj["save_path"])
+            for course_id, c_obj in course_ids.items()
+        }
+        scheduler = DownloadScheduler(
+            self.download_helper.run_job, dry_run=dry_run, **self.scheduler_options
+        )
+        self.download_helper.on_chunk = scheduler.on_chunk
+        self.download_helper.start_run()
+
+        def on_job(job):
+            job["manifest"] = manifests[job["course_id"]]
+            job["page_index"] = page_indexes[job["course_id"]]
+            if self.download_helper.is_current(job):
+                logging.info(
+                    colored(f"    - Skipping `{job['name']}` (unchanged)", "yellow")
+                )
+                return
+            if not dry_run:
+                self.download_helper.prepare_job(job)
+            scheduler.submit(job)
+
+        scheduler.start()
+        try:
+            crawler.crawl(course_ids, param, on_job)
+            results = scheduler.join()
+        finally:
+            self.download_helper.on_chunk = None
+            self.download_helper.close()
+
+        logging.info("")
+        crawler.log_stats()
+        if dry_run:
+            scheduler.log_plan(course_ids)
             logging.info("")
+            return 0
 
-    def download_module_files_all(self, course_ids, param):
-        logging.info(
-            colored(
-                "# Downloading Any Additional Files in Modules",
-                attrs=["bold", "reverse"],
-            )
-        )
+        for course_id in course_ids:
+            manifests[course_id].save()
+            page_indexes[course_id].save()
+        scheduler.log_progress()
 
+        num_files = {}
+        for job, downloaded in results:
+            key = (job["course_id"], job["phase"])
+            num_files[key] = num_files.get(key, 0) + int(downloaded)
         for course_id, c_obj in course_ids.items():
             c_name = c_obj["name"]
-            logging.info(colored(f"# Course: {c_name} - Modules", attrs=["bold"]))
-            save_path = c_obj["save_path"]
-            num_files = self.download_helper.download_module_files(
-                course_id, save_path, param
+            for phase, title in (("files", "Files"), ("modules", "Modules")):
+                count = num_files.get((course_id, phase), 0)
+                logging.info(
+                    f" => Course: {c_name} - {title} - Downloaded {count} files"
+                )
+                if count > 0:
+                    notify(f"{c_name} - {title}", f"Downloaded {count} files")
+        logging.info("")
+        return sum(num_files.values())
+
+    def get_courses(self, max_age=None):
+        """
+        Lists the user's active courses, with their terms, into courses_id_name_dict.
+        With max_age, a course catalog cached less than max_age seconds ago is used instead.
+        """
+        catalog = self.load_catalog(max_age) if max_age is not None else None
+        if catalog is None:
+            logging.info("# Fetching courses from Canvas:")
+            catalog, status = self.transport.get_all(
+                f"{self.canvas_api_heading}/api/v1/courses",
+                {"per_page": "100", "enrollment_state": "active", "include[]": "term"},
             )
-            logging.info(
-                f" => Course: {c_name} - Modules - Downloaded {num_files} files"
+            if status is not None:
+                raise RuntimeError(f"Could not list courses: status code {status}")
+            self.save_catalog(catalog)
+        else:
+            logging.info("# Using cached course catalog")
+
+        for course in catalog:
+            if "name" not in course or "course_code" not in course:
+                logging.info("  - Skipping invalid course entry.")
+                continue
+            self.courses[course["id"]] = course
+            self.courses_id_name_dict[
+                course["id"]
+            ] = f"{course['course_code'].replace(' ', '')} - {course['name']}"
+
+        logging.info(f"=> Found {len(self.courses_id_name_dict)} courses")
+        return self.courses_id_name_dict
+
+    def load_catalog(self, max_age):
+        if self.catalog_path is None or not os.path.isfile(self.catalog_path):
+            return None
+        try:
+            with open(self.catalog_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (
+            cached.get("canvas_api_heading") != self.canvas_api_heading
+            or time.time() - cached["fetched_at"] > max_age
+        ):
+            return None
+        return cached["courses"]
+
+    def save_catalog(self, catalog):
+        if self.catalog_path is None:
+            return
+        cached = {
+            "canvas_api_heading": self.canvas_api_heading,
+            "fetched_at": time.time(),
+            "courses": catalog,
+        }
+        tmp_path = f"{self.catalog_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cached, f)
+        os.replace(tmp_path, self.catalog_path)
+
+    @staticmethod
+    def is_current_term(course, now):
+        term = course.get("term") or {}
+        start_at = term.get("start_at") or course.get("start_at")
+        end_at = term.get("end_at") or course.get("end_at")
+        # Courses without dates, e.g. in the default term, count as current
+        if start_at and datetime.strptime(start_at, "%Y-%m-%dT%H:%M:%SZ") > now:
+            return False
+        if end_at and datetime.strptime(end_at, "%Y-%m-%dT%H:%M:%SZ") < now:
+            return False
+        return True
+
+    def auto_select_courses(self, rules, saved_courses, default_save_path=None):
+        """
+        Selects the active courses matching the course_rules from the config:
+        `code_regex` and `name_regex` are searched in the course code and name,
+        and `current_term` keeps courses whose term has started and not yet ended.
+        Saved courses keep their name and save path. With a default_save_path, courses
+        without a save path are saved to a folder named after them in it.
+        """
+        self.get_courses(max_age=self.catalog_ttl)
+        code_regex = rules.get("code_regex")
+        name_regex = rules.get("name_regex")
+        now = datetime.utcnow()
+
+        selected_courses = {}
+        for course_id, course in self.courses.items():
+            if code_regex and not re.search(code_regex, course["course_code"]):
+                continue
+            if name_regex and not re.search(name_regex, course["name"]):
+                continue
+            if rules.get("current_term") and not self.is_current_term(course, now):
+                continue
+            c_obj = dict(
+                saved_courses.get(str(course_id))
+                or {"name": self.courses_id_name_dict[course_id]}
             )
-            if num_files > 0:
-                notify(f"{c_name} - Modules", f"Downloaded {num_files} files")
-            logging.info("")
+            if default_save_path is not None and not c_obj.get("save_path"):
+                c_obj["save_path"] = os.path.join(default_save_path, c_obj["name"])
+            selected_courses[str(course_id)] = c_obj
+
+        logging.info("# Selected courses using course_rules:")
+        for i, c_obj in enumerate(selected_courses.values()):
+            logging.info(f"  {i + 1}. {c_obj['name']}")
+        return selected_courses
 
     def select_courses(
-        self, config_helper, rename_list=None, skip_confirmation_prompts=False
+        self,
+        config_helper,
+        rename_list=None,
+        skip_confirmation_prompts=False,
+        executor=None,
+        default_save_path=None,
     ):
         """
         Allows the user to select the courses that they want to transfer while generating a dictionary
-        that has course ids as the keys and their names as the values
+        that has course ids as the keys and their names as the values.
+        With course_rules in the config, courses are selected automatically instead.
+        Courses are only listed when needed; with an executor, the listing starts while the user
+        answers the prompt. rename_list may be a function, only called if the user picks courses.
+        default_save_path is passed on to auto_select_courses.
         """
         if rename_list is None:
             rename_list = []
-        logging.info("# Fetching courses from Canvas:")
-        canvas = Canvas("https://canvas.instructure.com", self.api_key)
-        courses_pag = canvas.get_courses()
-
-        i = 1
-        for c in courses_pag:
-            try:
-                self.courses_id_name_dict[
-                    c.id
-                ] = f"{c.course_code.replace(' ', '')} - {c.name}"
-                i += 1
-            except AttributeError:
-                logging.info("  - Skipping invalid course entry.")
-
-        logging.info(f"=> Found {len(self.courses_id_name_dict)} courses")
 
         courses = config_helper.get("courses")
+        for c_id, c_obj in (courses or {}).items():
+            if not isinstance(c_obj, dict):
+                courses[c_id] = {"name": c_obj}
+
+        rules = config_helper.get("course_rules")
+        if rules:
+            selected_courses = self.auto_select_courses(
+                rules, courses or {}, default_save_path
+            )
+            if selected_courses != courses:
+                config_helper.set("courses", selected_courses)
+            return selected_courses
+
+        courses_future = None
+        if executor is not None and not (courses and skip_confirmation_prompts):
+            courses_future = executor.submit(self.get_courses)
+
         if courses:
             logging.info("")
             logging.info("# You have previously selected courses:")
             for i, (c_id, c_obj) in enumerate(courses.items()):
-                try:
-                    c_name = c_obj["name"]
-                except TypeError:
-                    c_name = c_obj
-                    courses[c_id] = {"name": c_name}
-                logging.info(f"  {i + 1}. {c_name}")
+                logging.info(f"  {i + 1}. {c_obj['name']}")
             # use_previous_input = (
             #     "y"
             #     if skip_confirmation_prompts
@@ -169,6 +360,15 @@ class CanvasHelper:
             logging.info("# Skipping course selection.")
             return {}
 
+        from pick import pick
+
+        if courses_future is not None:
+            courses_future.result()
+        else:
+            self.get_courses()
+        if callable(rename_list):
+            rename_list = rename_list()
+
         title = "Select the course(s) you would like to use (press SPACE to mark, ENTER to continue):"
 
         sorted_ids, sorted_courses = zip(
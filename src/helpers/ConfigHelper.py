@@ -7,6 +7,12 @@ from datetime import datetime
 from src.Utils import p_error, p_info, p_warn
 
 
+class ConfigError(Exception):
+    """
+    The configuration is missing something that can't be asked for without prompts
+    """
+
+
 class ConfigHelper:
     def __init__(
         self,
@@ -29,6 +35,12 @@ class ConfigHelper:
         # if not self.config:
         self.create_config()
 
+    def reload(self):
+        """
+        Reads the configuration file again, e.g. after it was edited while running
+        """
+        self.config = self.load_config()
+
     def get(self, key):
         return self.config[key] if key in self.config else None
 
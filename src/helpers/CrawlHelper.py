@@ -0,0 +1,393 @@
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+from http import HTTPStatus
+
+from termcolor import colored
+
+
+# Module item type -> (collection endpoint, module item key, collection object key, params)
+MODULE_ITEM_COLLECTIONS = {
+    "page": ("pages", "page_url", "url", {"include[]": "body"}),
+    "assignment": ("assignments", "content_id", "id", {}),
+    "quiz": ("quizzes", "content_id", "id", {}),
+    "discussion": ("discussion_topics", "content_id", "id", {}),
+}
+
+
+def clean_folder_name(name):
+    # Replace +, _, -, and spaces with -
+    return re.sub(r"[\s+_\-:\.]+", "-", name)
+
+
+class CanvasCrawler:
+    def __init__(self, transport, canvas_api_heading, max_workers=8, dry_run=False):
+        self.transport = transport
+        self.canvas_api_heading = canvas_api_heading
+        self.max_workers = max_workers
+        # Only lists; nothing is written to the save paths
+        self.dry_run = dry_run
+        self.frontier = queue.Queue()
+        self.stats = {}
+        # Canvas file id -> (folder path, file) of every file found in the Files of a course
+        self.course_files = {}
+        # (course id, module item type) -> objects of the bulk-listed collection
+        self.item_index = {}
+        self.item_index_locks = {}
+        self.stats_lock = threading.Lock()
+        self.param = {}
+        self.on_job = None
+
+    def crawl(self, course_ids, param, on_job):
+        """
+        Crawls the Files and Modules of every course in course_ids (which must have a save_path).
+        Every listing is a task on a shared frontier queue served by a bounded pool of workers,
+        and each task pushes the listings it discovers. Files and pages are handed to on_job.
+        Returns per-course statistics: crawl depth, number of listings and jobs, and timings.
+        """
+        self.param = param
+        self.on_job = on_job
+        for course_id, c_obj in course_ids.items():
+            self.stats[course_id] = {
+                "name": c_obj["name"],
+                "started": time.time(),
+                "finished": time.time(),
+                "max_depth": 0,
+                "listings": 0,
+                "jobs": 0,
+                "index_hits": 0,
+            }
+            self.course_files[course_id] = {}
+            self._push(course_id, 0, self._crawl_folders, c_obj["save_path"])
+
+        workers = [
+            threading.Thread(target=self._worker, daemon=True)
+            for _ in range(self.max_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        self.frontier.join()
+        for _ in workers:
+            self.frontier.put(None)
+        for worker in workers:
+            worker.join()
+        return self.stats
+
+    def log_stats(self):
+        logging.info("# Crawl statistics:")
+        for stats in self.stats.values():
+            duration = round(stats["finished"] - stats["started"], 2)
+            logging.info(
+                f"  - {stats['name']}: depth {stats['max_depth']}, "
+                f"{stats['listings']} listings, {stats['jobs']} jobs, "
+                f"{stats['index_hits']} module items from listings, {duration}s"
+            )
+
+    def _push(self, course_id, depth, handler, *args):
+        self.frontier.put((course_id, depth, handler, args))
+
+    def _worker(self):
+        while True:
+            task = self.frontier.get()
+            if task is None:
+                self.frontier.task_done()
+                return
+            course_id, depth, handler, args = task
+            try:
+                handler(course_id, depth, *args)
+            except Exception as e:
+                logging.info(colored(f"  - Error: {e}", "red"))
+                traceback.print_exc()
+            finally:
+                with self.stats_lock:
+                    stats = self.stats[course_id]
+                    stats["max_depth"] = max(stats["max_depth"], depth)
+                    stats["finished"] = time.time()
+                self.frontier.task_done()
+
+    def _list(self, course_id, url, params=None):
+        with self.stats_lock:
+            self.stats[course_id]["listings"] += 1
+        return self.transport.get_all(url, dict(self.param, **(params or {})))
+
+    def _emit(self, course_id, job):
+        with self.stats_lock:
+            self.stats[course_id]["jobs"] += 1
+        job["course_id"] = course_id
+        self.on_job(job)
+
+    def _crawl_folders(self, course_id, depth, save_path):
+        try:
+            self._crawl_course_files(course_id, depth, save_path)
+        finally:
+            # Modules are crawled once the Files listing is known, so module items
+            # can be matched with files that are already being downloaded
+            self._push(
+                course_id,
+                0,
+                self._crawl_modules,
+                os.path.join(save_path, "course-files"),
+            )
+
+    def _crawl_course_files(self, course_id, depth, save_path):
+        folders, status = self._list(
+            course_id,
+            f"{self.canvas_api_heading}/api/v1/courses/{str(course_id)}/folders",
+        )
+        if status is not None:
+            logging.info(colored(f"  - Error: {status}", "red"))
+            return
+
+        folder_paths = {}
+        for folder in folders:
+            folder_name = clean_folder_name(folder["full_name"])
+            folder_path = os.path.join(save_path, folder_name.lower())
+            if not self.dry_run:
+                os.makedirs(folder_path, exist_ok=True)
+            folder_paths[folder["id"]] = folder_path
+
+        # One paginated listing of every file in the course, instead of one per folder
+        files, status = self._list(
+            course_id,
+            f"{self.canvas_api_heading}/api/v1/courses/{str(course_id)}/files",
+        )
+        if status is not None:
+            logging.info(
+                colored(
+                    f"  - Course file listing => {status}, listing by folder", "red"
+                )
+            )
+            for folder in folders:
+                self._push(
+                    course_id,
+                    depth + 1,
+                    self._crawl_folder_files,
+                    folder,
+                    folder_paths[folder["id"]],
+                )
+            return
+
+        folder_files = {folder["id"]: [] for folder in folders}
+        for file in files:
+            folder_files.setdefault(file["folder_id"], []).append(file)
+        for folder in folders:
+            self._emit_folder_files(
+                course_id,
+                folder,
+                folder_paths[folder["id"]],
+                folder_files[folder["id"]],
+            )
+
+    def _crawl_folder_files(self, course_id, depth, folder, folder_path):
+        folder_name = clean_folder_name(folder["full_name"])
+        files, status = self._list(course_id, folder["files_url"])
+
+        if status is not None:
+            reason = HTTPStatus(status).phrase.replace(" ", "-")
+            if not self.dry_run:
+                with open(
+                    os.path.join(folder_path, f".canvas-sync-{reason}.json"), "w"
+                ) as f:
+                    json.dump(files, f, indent=4)
+            logging.info(
+                colored(f"  * Folder: `{folder_name}` => {status} - {reason}", "red")
+            )
+            return
+
+        self._emit_folder_files(course_id, folder, folder_path, files)
+
+    def _emit_folder_files(self, course_id, folder, folder_path, files):
+        folder_name = clean_folder_name(folder["full_name"])
+        if not self.dry_run:
+            with open(os.path.join(folder_path, ".canvas-sync-OK.json"), "w") as f:
+                json.dump(files, f, indent=4)
+
+        logging.info(
+            f" * Folder `{folder_name}` (Folders: {folder['folders_count']}, "
+            f"Files: {folder['files_count']})"
+        )
+        for file in files:
+            self.course_files[course_id][file["id"]] = (folder_path, file)
+            self._emit(
+                course_id,
+                {
+                    "phase": "files",
+                    "type": "file",
+                    "name": file["display_name"],
+                    "url": file["url"],
+                    "file_obj": file,
+                    "folder_path": folder_path,
+                    "subfolder_name": None,
+                },
+            )
+
+    def _crawl_modules(self, course_id, depth, save_path):
+        modules, status = self._list(
+            course_id,
+            f"{self.canvas_api_heading}/api/v1/courses/{str(course_id)}/modules",
+        )
+        if status is not None:
+            logging.info(colored(f"  - Error: {status}", "red"))
+            return
+
+        for module in modules:
+            module_name = clean_folder_name(module["name"])
+            logging.info(f" * Module: `{module_name}`")
+            self._push(
+                course_id,
+                depth + 1,
+                self._crawl_module_items,
+                module["items_url"],
+                module_name.lower(),
+                save_path,
+            )
+
+    def _crawl_module_items(self, course_id, depth, items_url, module_name, save_path):
+        items, status = self._list(course_id, items_url)
+        if status is not None:
+            logging.info(colored(f"  - Error: {status}", "red"))
+            return
+
+        for item in items:
+            if "url" not in item:
+                logging.info(colored(f"    - {item['type']} - Skipping", "yellow"))
+                continue
+            self._push(
+                course_id,
+                depth + 1,
+                self._crawl_module_item,
+                item,
+                module_name,
+                save_path,
+            )
+
+    def _crawl_module_item(self, course_id, depth, item, module_name, save_path):
+        file_type = item["type"].lower()
+        if file_type != "file":
+            folder_path = os.path.join(save_path, module_name)
+        else:
+            folder_path = save_path
+
+        content = self._lookup_module_item(course_id, item)
+        if content is not None:
+            with self.stats_lock:
+                self.stats[course_id]["index_hits"] += 1
+        else:
+            with self.stats_lock:
+                self.stats[course_id]["listings"] += 1
+            response = self.transport.get(item["url"], use_cache=True)
+            content = response.json()
+
+        try:
+            if file_type == "file":
+                subfolder_name = module_name
+                known_path, _ = self.course_files[course_id].get(
+                    content["id"], (None, None)
+                )
+                if known_path is not None:
+                    # Listed in Files too: share the copy in the root folder, otherwise
+                    # keep a copy in the module folder
+                    subfolder_name = None
+                    if known_path != save_path:
+                        folder_path = os.path.join(save_path, module_name)
+                self._emit(
+                    course_id,
+                    {
+                        "phase": "modules",
+                        "type": "file",
+                        "name": content["display_name"],
+                        "url": content["url"],
+                        "file_obj": content,
+                        "folder_path": folder_path,
+                        "subfolder_name": subfolder_name,
+                    },
+                )
+                return
+
+            if file_type == "externaltool":
+                if self.dry_run:
+                    return
+                os.makedirs(folder_path, exist_ok=True)
+                with open(
+                    os.path.join(folder_path, f"{content['name']}.json"), "w"
+                ) as f:
+                    f.write(json.dumps(item, indent=4))
+                return
+
+            if file_type == "page":
+                file_name, body = content["title"], content["body"]
+            elif file_type == "assignment":
+                file_name, body = content["name"], content["description"]
+            elif file_type == "quiz":
+                file_name, body = content["title"], content["description"]
+            elif file_type == "discussion":
+                file_name, body = content["title"], content["message"]
+            else:
+                raise Exception(f"Unknown file type: {item['type']}")
+
+            self._emit(
+                course_id,
+                {
+                    "phase": "modules",
+                    "type": "html",
+                    "name": file_name,
+                    "body": body,
+                    "folder_path": folder_path,
+                },
+            )
+        except Exception as e:
+            logging.info(colored(f"    - {item['type']} - Error: {e}", "red"))
+            logging.info(json.dumps(item, indent=4))
+            logging.info(json.dumps(content, indent=4))
+
+    def _lookup_module_item(self, course_id, item):
+        """
+        Finds the content of a module item in the Files listing or in the bulk listing of its
+        collection, so it doesn't need a request of its own. Returns None if it isn't there.
+        """
+        file_type = item["type"].lower()
+        if file_type == "file":
+            _, file = self.course_files[course_id].get(
+                item.get("content_id"), (None, None)
+            )
+            return file
+        if file_type not in MODULE_ITEM_COLLECTIONS:
+            return None
+        _, item_key, _, _ = MODULE_ITEM_COLLECTIONS[file_type]
+        content = self._get_item_index(course_id, file_type).get(item.get(item_key))
+        if file_type == "page" and content is not None and "body" not in content:
+            # Locked pages are listed without their body
+            return None
+        return content
+
+    def _get_item_index(self, course_id, file_type):
+        # Each collection is listed once per course, the first time one of its items is needed
+        with self.stats_lock:
+            lock = self.item_index_locks.setdefault(
+                (course_id, file_type), threading.Lock()
+            )
+        with lock:
+            if (course_id, file_type) not in self.item_index:
+                collection, _, content_key, params = MODULE_ITEM_COLLECTIONS[file_type]
+                contents, status = self._list(
+                    course_id,
+                    f"{self.canvas_api_heading}/api/v1/courses/{str(course_id)}/{collection}",
+                    params,
+                )
+                if status is not None:
+                    logging.info(
+                        colored(
+                            f"  - Listing {collection} => {status}, fetching items one by one",
+                            "yellow",
+                        )
+                    )
+                    contents = []
+                self.item_index[(course_id, file_type)] = {
+                    content[content_key]: content for content in contents
+                }
+            return self.item_index[(course_id, file_type)]
@@ -0,0 +1,108 @@
+import hashlib
+import html
+import re
+from html.parser import HTMLParser
+
+ENGINES = ("fast", "bs4")
+
+# The name of a start tag, then its attributes in order: a name and an optional
+# quoted or bare value, so text inside a quoted value is never taken for an attribute
+TAG_NAME = re.compile(r"<[^\s/>]+")
+TAG_ATTR = re.compile(r"""([^\s"'>/=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?""")
+
+
+def image_name(img_url):
+    # create a hash of the url to use as the filename
+    return hashlib.md5(img_url.encode("utf-8")).hexdigest()
+
+
+class _ImageTagParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.tags = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "img":
+            # Like browsers, use the first of repeated src attributes
+            src = next((value for name, value in attrs if name == "src"), None)
+            if src is not None:
+                self.tags.append((self.getpos(), self.get_starttag_text(), src))
+
+
+def _replace_src(tag_text, src, new_src):
+    """
+    Returns the img tag with the value of its first src attribute replaced by new_src
+    """
+    pos = TAG_NAME.match(tag_text).end()
+    while True:
+        match = TAG_ATTR.search(tag_text, pos)
+        if match is None:
+            raise ValueError("No src attribute in the img tag")
+        pos = match.end()
+        if match.group(1).lower() != "src" or match.group(2) is None:
+            continue
+        value = match.group(2)
+        if value[0] in "\"'":
+            value = value[1:-1]
+        if html.unescape(value) != src:
+            raise ValueError("Tokenizer attributes do not match the img tag")
+        return f'{tag_text[: match.start(2)]}"{new_src}"{tag_text[match.end(2) :]}'
+
+
+def _localize_fast(body):
+    if "<img" not in body.lower():
+        return body, []
+    parser = _ImageTagParser()
+    parser.feed(body)
+    parser.close()
+
+    # getpos() is (line, column); turn it into an offset in body
+    line_starts = [0]
+    for match in re.finditer("\n", body):
+        line_starts.append(match.end())
+
+    parts = []
+    img_urls = []
+    last = 0
+    for (line, column), tag_text, src in parser.tags:
+        if not src.startswith("http"):
+            continue
+        start = line_starts[line - 1] + column
+        end = start + len(tag_text)
+        if body[start:end] != tag_text:
+            raise ValueError("Tokenizer positions do not match the page body")
+        new_tag = _replace_src(tag_text, src, f"./img/{image_name(src)}")
+        parts.extend((body[last:start], new_tag))
+        last = end
+        img_urls.append(src)
+    parts.append(body[last:])
+    return "".join(parts), img_urls
+
+
+def _localize_bs4(body):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(body, "html.parser")
+    img_urls = []
+    for img in soup.find_all("img"):
+        if "src" in img.attrs and img.attrs["src"].startswith("http"):
+            img_urls.append(img.attrs["src"])
+            img.attrs["src"] = f"./img/{image_name(img.attrs['src'])}"
+    return soup.prettify(), img_urls
+
+
+def localize_images(body, engine="fast"):
+    """
+    Points every remote img src of a page at ./img/<md5 of the url>.
+    Returns the rewritten page and the image urls, in page order.
+    The fast engine only tokenizes the page and rewrites the img tags in place;
+    bs4 parses and re-serializes the whole page, and is used if tokenizing fails.
+    Runs in worker processes, so it only takes and returns plain data.
+    """
+    body = body or ""
+    if engine == "fast":
+        try:
+            return _localize_fast(body)
+        except Exception:
+            pass
+    return _localize_bs4(body)
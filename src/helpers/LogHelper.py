@@ -1,9 +1,10 @@
 import logging
 
-from notifypy import Notify
-
 
 def notify(title, message):
+    # notifypy is slow to import, so only load it when a notification is sent
+    from notifypy import Notify
+
     notification = Notify()
     notification.title = title
     notification.message = message
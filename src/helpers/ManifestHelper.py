@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import threading
+
+from src.helpers.LogHelper import log_w
+
+MANIFEST_FILE_NAME = ".canvas-sync-manifest.json"
+PAGE_INDEX_FILE_NAME = ".canvas-sync-pages.json"
+
+
+def _load_entries(path, is_valid):
+    """
+    Reads the entries saved at path, keeping those is_valid accepts.
+    A missing, truncated or corrupt file, e.g. after an interrupted run, gives no entries,
+    so everything it covered is checked again.
+    """
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+        if not isinstance(entries, dict):
+            raise ValueError("expected an object")
+    except (OSError, ValueError) as e:
+        log_w(f"Could not read {path}, starting over: {e}")
+        return {}
+    return {key: entry for key, entry in entries.items() if is_valid(entry)}
+
+
+class DownloadManifest:
+    def __init__(self, save_path):
+        self.path = os.path.join(save_path, MANIFEST_FILE_NAME)
+        self.lock = threading.Lock()
+        self.entries = _load_entries(
+            self.path,
+            lambda entry: isinstance(entry, dict)
+            and {"updated_at", "size", "paths"} <= entry.keys()
+            and isinstance(entry["paths"], list),
+        )
+
+    def is_current(self, file_obj, file_path):
+        """
+        True if this version of the Canvas file was already saved to file_path
+        """
+        entry = self.entries.get(str(file_obj.get("id")))
+        return (
+            entry is not None
+            and entry["updated_at"] == file_obj.get("updated_at")
+            and entry["size"] == file_obj.get("size")
+            and file_path in entry["paths"]
+            and os.path.isfile(file_path)
+        )
+
+    def record(self, file_obj, file_path):
+        file_id = str(file_obj["id"])
+        with self.lock:
+            entry = self.entries.get(file_id)
+            if (
+                entry is None
+                or entry["updated_at"] != file_obj.get("updated_at")
+                or entry["size"] != file_obj.get("size")
+            ):
+                # A new version invalidates every path of the previous one
+                entry = {
+                    "updated_at": file_obj.get("updated_at"),
+                    "size": file_obj.get("size"),
+                    "paths": [],
+                }
+                self.entries[file_id] = entry
+            if file_path not in entry["paths"]:
+                entry["paths"].append(file_path)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with self.lock:
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+class PageHashIndex:
+    def __init__(self, save_path):
+        self.save_path = save_path
+        self.path = os.path.join(save_path, PAGE_INDEX_FILE_NAME)
+        self.lock = threading.Lock()
+        # Page path relative to save_path -> hash of the page body as returned by Canvas
+        self.entries = _load_entries(self.path, lambda entry: isinstance(entry, str))
+
+    @staticmethod
+    def hash_body(body):
+        return hashlib.sha1((body or "").encode("utf-8")).hexdigest()
+
+    def _key(self, file_path):
+        return os.path.relpath(file_path, self.save_path)
+
+    def get(self, file_path):
+        return self.entries.get(self._key(file_path))
+
+    def is_current(self, file_path, body):
+        """
+        True if file_path was written from this exact Canvas body
+        """
+        return self.get(file_path) == self.hash_body(body) and os.path.isfile(file_path)
+
+    def record(self, file_path, body):
+        with self.lock:
+            self.entries[self._key(file_path)] = self.hash_body(body)
+
+    def save(self):
+        os.makedirs(self.save_path, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with self.lock:
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=4)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,135 @@
+import logging
+import random
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+
+
+def is_throttled(response):
+    """
+    Canvas throttles with 403 "Rate Limit Exceeded"; other hosts may use 429
+    """
+    if response.status_code == 429:
+        return True
+    return response.status_code == 403 and "Rate Limit Exceeded" in response.text
+
+
+def _header_float(response, name):
+    try:
+        return float(response.headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class ConcurrencyController:
+    def __init__(
+        self,
+        initial_limit=8,
+        min_limit=1,
+        max_limit=32,
+        low_remaining=100,
+        max_retries=5,
+        backoff=1.0,
+        max_backoff=30.0,
+    ):
+        """
+        Limits the number of requests in flight, AIMD style: the limit grows by about
+        one per round of successful requests, and is halved when Canvas throttles or
+        X-Rate-Limit-Remaining runs low.
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        # Shrink before Canvas starts refusing requests
+        self.low_remaining = low_remaining
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.last_decrease = 0
+        self.lowest_limit = self.limit
+        self.num_throttled = 0
+        self.num_decreases = 0
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= max(self.min_limit, int(self.limit)):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, response):
+        """
+        Frees a slot and adjusts the limit to the response. Returns True if it was throttled.
+        """
+        throttled = response is not None and is_throttled(response)
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.num_throttled += 1
+                self._decrease()
+            elif response is not None:
+                remaining = _header_float(response, "X-Rate-Limit-Remaining")
+                cost = _header_float(response, "X-Request-Cost") or 0
+                if (
+                    remaining is not None
+                    and remaining - cost * self.in_flight < self.low_remaining
+                ):
+                    self._decrease()
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+        return throttled
+
+    def _decrease(self):
+        now = time.monotonic()
+        # Requests already in flight report the same congestion; only react once
+        if now - self.last_decrease < 1:
+            return
+        self.last_decrease = now
+        self.num_decreases += 1
+        self.limit = max(self.min_limit, self.limit / 2)
+        self.lowest_limit = min(self.lowest_limit, self.limit)
+
+    def get_backoff(self, attempt, response):
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+        # Full jitter, so throttled workers don't retry in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def log_stats(self):
+        logging.info(
+            f"# Rate limiting: {self.num_throttled} throttled responses, "
+            f"{self.num_decreases} slowdowns, concurrency {round(self.limit, 1)} "
+            f"(lowest {round(self.lowest_limit, 1)}, max {self.max_limit})"
+        )
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    def __init__(self, controller, **kwargs):
+        self.controller = controller
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        """
+        Sends the request within the controller's limit, retrying throttled responses
+        """
+        attempt = 0
+        while True:
+            self.controller.acquire()
+            response = None
+            try:
+                response = super().send(request, **kwargs)
+            finally:
+                throttled = self.controller.release(response)
+            if not throttled or attempt >= self.controller.max_retries:
+                return response
+            delay = self.controller.get_backoff(attempt, response)
+            logging.info(
+                f"  - Throttled ({response.status_code}), retrying in {round(delay, 2)}s"
+            )
+            response.close()
+            time.sleep(delay)
+            attempt += 1
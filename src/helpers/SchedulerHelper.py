@@ -0,0 +1,205 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from datetime import timedelta
+
+from termcolor import colored
+
+POLICIES = ("small-first", "round-robin", "fifo")
+
+
+def job_size(job):
+    """
+    Planned number of bytes of a crawler job, from the size Canvas returns for files
+    """
+    if job["type"] == "html":
+        return len(job.get("body") or "")
+    return job["file_obj"].get("size") or 0
+
+
+def format_mb(num_bytes):
+    return f"{round(num_bytes / 1000000, 2)} MB"
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        # rate is in bytes per second
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, num_bytes):
+        """
+        Blocks until num_bytes may be sent. Callers borrow against future tokens,
+        so concurrent streams share the rate instead of each getting all of it.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= num_bytes
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class DownloadScheduler:
+    def __init__(
+        self,
+        run_job,
+        max_workers=8,
+        policy="small-first",
+        bandwidth_limit=None,
+        progress_interval=5,
+        dry_run=False,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(
+                f"Unknown download policy `{policy}`, use one of {', '.join(POLICIES)}"
+            )
+        self.run_job = run_job
+        self.max_workers = max_workers
+        self.policy = policy
+        # Global cap in bytes per second shared by every download
+        self.bucket = TokenBucket(bandwidth_limit) if bandwidth_limit else None
+        self.progress_interval = progress_interval
+        self.dry_run = dry_run
+
+        self.pending = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.course_ranks = {}
+        self.course_counts = {}
+        self.results = []
+        self.workers = []
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+        self.planned_jobs = 0
+        self.planned_bytes = 0
+        self.completed_jobs = 0
+        self.completed_bytes = 0
+        self.transferred_bytes = 0
+        self.started = None
+
+    def start(self):
+        self.started = time.monotonic()
+        if self.dry_run:
+            return
+        self.workers = [
+            threading.Thread(target=self._worker, daemon=True)
+            for _ in range(self.max_workers)
+        ]
+        self.workers.append(threading.Thread(target=self._reporter, daemon=True))
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, job):
+        """
+        Queues a job; the next free worker picks the job that comes first under the policy
+        """
+        size = job_size(job)
+        with self.lock:
+            self.planned_jobs += 1
+            self.planned_bytes += size
+            if self.dry_run:
+                self.results.append((job, False))
+                return
+            course_id = job.get("course_id")
+            if course_id not in self.course_ranks:
+                self.course_ranks[course_id] = len(self.course_ranks)
+                self.course_counts[course_id] = 0
+            self.course_counts[course_id] += 1
+            if self.policy == "small-first":
+                key = (size,)
+            elif self.policy == "round-robin":
+                # The n-th job of every course goes before the (n+1)-th of any course
+                key = (self.course_counts[course_id], self.course_ranks[course_id])
+            else:
+                key = ()
+        self.pending.put((key, next(self.counter), job))
+
+    def join(self):
+        """
+        Waits for every queued job and returns a list of (job, result)
+        """
+        if not self.dry_run:
+            self.pending.join()
+            self.stopped.set()
+            for _ in range(self.max_workers):
+                self.pending.put(((float("inf"),), next(self.counter), None))
+            for worker in self.workers:
+                worker.join()
+        return self.results
+
+    def on_chunk(self, num_bytes):
+        """
+        Called by the downloader for every chunk it writes; applies the bandwidth cap
+        """
+        if self.bucket is not None:
+            self.bucket.consume(num_bytes)
+        with self.lock:
+            self.transferred_bytes += num_bytes
+
+    def _worker(self):
+        while True:
+            _, _, job = self.pending.get()
+            if job is None:
+                self.pending.task_done()
+                return
+            try:
+                result = self.run_job(job)
+            except Exception as e:
+                logging.info(colored(f"  - Error: {e}", "red"))
+                result = False
+            with self.lock:
+                self.results.append((job, result))
+                self.completed_jobs += 1
+                self.completed_bytes += job_size(job)
+            self.pending.task_done()
+
+    def _reporter(self):
+        while not self.stopped.wait(self.progress_interval):
+            self.log_progress()
+
+    def log_progress(self):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 0.001)
+            rate = self.transferred_bytes / elapsed
+            remaining = self.planned_bytes - self.completed_bytes
+            completed_jobs, planned_jobs = self.completed_jobs, self.planned_jobs
+            completed_bytes, planned_bytes = self.completed_bytes, self.planned_bytes
+        eta = str(timedelta(seconds=round(remaining / rate))) if rate > 0 else "?"
+        logging.info(
+            colored(
+                f" => Progress: {completed_jobs}/{planned_jobs} jobs, "
+                f"{format_mb(completed_bytes)}/{format_mb(planned_bytes)}, "
+                f"{format_mb(rate)}/s, ETA {eta}",
+                "cyan",
+            )
+        )
+
+    def log_plan(self, course_ids):
+        """
+        Logs the number of files and bytes a dry run would have downloaded
+        """
+        logging.info("# Dry run: planned downloads")
+        totals = {}
+        for job, _ in self.results:
+            course = totals.setdefault(job["course_id"], {"files": 0, "pages": 0})
+            course["files" if job["type"] == "file" else "pages"] += 1
+            course["bytes"] = course.get("bytes", 0) + job_size(job)
+        for course_id, c_obj in course_ids.items():
+            course = totals.get(course_id, {"files": 0, "pages": 0, "bytes": 0})
+            logging.info(
+                f"  - {c_obj['name']}: {course['files']} files, "
+                f"{course['pages']} pages, {format_mb(course['bytes'])}"
+            )
+        logging.info(
+            f" => Total: {self.planned_jobs} jobs, {format_mb(self.planned_bytes)}"
+        )
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+
+class SyncStateHelper:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS assignments ("
+            " assignment_id TEXT PRIMARY KEY, task_id TEXT,"
+            " content_hash TEXT, synced_at REAL)"
+        )
+        self.db.commit()
+        # Load everything up front; one row per assignment is small
+        self.states = {
+            assignment_id: (task_id, content_hash)
+            for assignment_id, task_id, content_hash in self.db.execute(
+                "SELECT assignment_id, task_id, content_hash FROM assignments"
+            )
+        }
+
+    @staticmethod
+    def make_hash(assignment, project_id, priority, submitted):
+        """
+        Hashes every field of an assignment that ends up in its Todoist task
+        """
+        fields = [
+            assignment["name"],
+            assignment["html_url"],
+            assignment["description"],
+            assignment["due_at"],
+            project_id,
+            priority,
+            submitted,
+        ]
+        return hashlib.sha1(json.dumps(fields).encode("utf-8")).hexdigest()
+
+    def get(self, assignment_id):
+        """
+        Returns the (task_id, content_hash) recorded for an assignment, or None
+        """
+        return self.states.get(str(assignment_id))
+
+    def set(self, assignment_id, task_id, content_hash):
+        self.states[str(assignment_id)] = (task_id, content_hash)
+        self.db.execute(
+            "INSERT OR REPLACE INTO assignments VALUES (?, ?, ?, ?)",
+            (str(assignment_id), task_id, content_hash, time.time()),
+        )
+
+    def commit(self):
+        self.db.commit()
@@ -1,30 +1,182 @@
+import json
 import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from termcolor import colored
-from todoist_api_python.api import TodoistAPI
 
 from src.helpers.LogHelper import log_i, log_w
+from src.helpers.TodoistSyncHelper import (
+    PRIORITY_HIGH,
+    PRIORITY_LOW,
+    PRIORITY_NORMAL,
+    PRIORITY_URGENT,
+    SYNC_URL,
+    TodoistSyncHelper,
+)
 from src.Utils import p_info
 
 
 class TodoistHelper:
-    def __init__(self, api_key):
+    def __init__(
+        self,
+        api_key,
+        sync_url=SYNC_URL,
+        snapshot_path=None,
+        full_sync=False,
+        budget=None,
+    ):
         p_info("# TodoistHelper: Initialized")
         logging.info(colored(f"  - Todoist API Key: {api_key}", "grey"))
-        self.api = TodoistAPI(api_key.strip())
-        self.tasks = self.api.get_tasks()
-        self.projects = self.api.get_projects()
+        self.api_key = api_key.strip()
+        self._api = None
+        # Requests to Todoist are counted against its per-user quota
+        self.budget = budget
+        # Writes are queued and sent in batches through the Sync API
+        self.sync_helper = TodoistSyncHelper(api_key, sync_url=sync_url, budget=budget)
+        # Local copy of the account, refreshed incrementally with the sync_token
+        self.snapshot_path = snapshot_path
+        self.sync_token = "*"
+        # Tasks and projects are kept as dicts in the Sync API format, keyed by id
+        self.tasks = {}
+        self.projects = {}
+        # (command uuid, undo) for every queued write: the local copy is changed when a
+        # command is queued, and undo() restores it if Todoist doesn't apply the command
+        self._undo = []
+        if not full_sync:
+            self.load_snapshot()
+        self.refresh()
+
+    @property
+    def api(self):
+        """
+        REST client, only used to create projects; created on first use as it is slow to import
+        """
+        if self._api is None:
+            from todoist_api_python.api import TodoistAPI
+
+            self._api = TodoistAPI(self.api_key)
+        return self._api
+
+    def load_snapshot(self):
+        if self.snapshot_path is None or not os.path.isfile(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            sync_token = str(snapshot["sync_token"])
+            # A snapshot written by an older version may lack keys or use other types
+            tasks = dict(snapshot["items"])
+            projects = dict(snapshot["projects"])
+            for objects, keys in (
+                (tasks, {"id", "project_id", "content"}),
+                (projects, {"id", "name"}),
+            ):
+                if not all(
+                    isinstance(o, dict) and keys <= o.keys() for o in objects.values()
+                ):
+                    raise ValueError("unexpected snapshot format")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log_w(f"Could not read Todoist snapshot, doing a full sync: {e}")
+            return
+        self.sync_token = sync_token
+        self.tasks = tasks
+        self.projects = projects
+
+    def save_snapshot(self):
+        if self.snapshot_path is None:
+            return
+        snapshot = {
+            "sync_token": self.sync_token,
+            "items": self.tasks,
+            "projects": self.projects,
+        }
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def refresh(self):
+        """
+        Requests the changes since the stored sync_token and merges them into the local snapshot.
+        Falls back to a full sync when there is no token or the token is rejected.
+        """
+        result = self.sync_helper.read(self.sync_token, ["projects", "items"])
+        if result is None and self.sync_token != "*":
+            log_w("Todoist rejected the sync token, doing a full sync")
+            self.sync_token = "*"
+            result = self.sync_helper.read(self.sync_token, ["projects", "items"])
+        if result is None:
+            raise RuntimeError("Could not load tasks and projects from Todoist")
+
+        if result.get("full_sync"):
+            self.tasks = {}
+            self.projects = {}
+        for item in result.get("items", []):
+            if item.get("is_deleted") or item.get("checked"):
+                self.tasks.pop(item["id"], None)
+            else:
+                self.tasks[item["id"]] = item
+        for project in result.get("projects", []):
+            if project.get("is_deleted") or project.get("is_archived"):
+                self.projects.pop(project["id"], None)
+            else:
+                self.projects[project["id"]] = project
+        self.sync_token = result["sync_token"]
+
+        sync_type = "Full" if result.get("full_sync") else "Incremental"
+        logging.info(
+            f"  - {sync_type} sync: {len(result.get('items', []))} task and "
+            f"{len(result.get('projects', []))} project changes"
+        )
+        self.save_snapshot()
+        self._build_indexes()
+
+    def _build_indexes(self):
+        # Project name -> id, plus the names that are used by more than one project
+        self.project_ids = {}
+        self.duplicate_project_names = set()
+        for project in self.projects.values():
+            self._register_project(project)
+        # (project_id, content) -> tasks, and Canvas html_url -> tasks
+        self.task_index = {}
+        self.url_index = {}
+        for task in self.tasks.values():
+            self._index_task(task)
+
+    def _index_task(self, task):
+        key = (task["project_id"], task["content"])
+        self.task_index.setdefault(key, []).append(task)
+        url = self.parse_link_url(task["content"])
+        if url is not None:
+            self.url_index.setdefault(url, []).append(task)
+
+    def _unindex_task(self, task):
+        for index, key in (
+            (self.task_index, (task["project_id"], task["content"])),
+            (self.url_index, self.parse_link_url(task["content"])),
+        ):
+            tasks = [t for t in index.get(key, []) if t is not task]
+            if tasks:
+                index[key] = tasks
+            else:
+                index.pop(key, None)
 
     def find_task(self, project_id, title):
         """
-        Finds a task with the given title in the given project
+        Finds a task with the given title in the given project.
+        Falls back to matching the Canvas URL in the title, so renamed assignments are still found.
         """
-        tasks = []
-        for task in self.tasks:
-            if task.project_id == project_id and task.content == title:
-                tasks.append(task)
-        if len(tasks) == 0:
+        tasks = self.task_index.get((project_id, title))
+        if not tasks:
+            url = self.parse_link_url(title)
+            tasks = self.url_index.get(url) if url is not None else None
+            if tasks:
+                # Prefer a task in the expected project
+                tasks = sorted(tasks, key=lambda t: t["project_id"] != project_id)
+        if not tasks:
             # log_i(
             #     f'Could not find task "{title}" in project "{project_id}"',
             # )
@@ -39,55 +191,181 @@ class TodoistHelper:
             #     self.api.delete_task(task.id)
         return tasks[0]
 
+    def add_task(self, content, description, project_id, priority, due_string):
+        """
+        Queues a new task and adds a local copy, under a temp id, to the task indexes.
+        The temp id is replaced by the real one when the queue is flushed.
+        """
+        temp_id = self.sync_helper.new_temp_id()
+        args = {"content": content, "project_id": project_id, "priority": priority}
+        if description:
+            args["description"] = description
+        if due_string is not None:
+            args["due"] = {"string": due_string}
+        # Urgent tasks are sent first
+        command_uuid = self.sync_helper.queue(
+            "item_add",
+            args,
+            temp_id=temp_id,
+            priority=PRIORITY_URGENT if priority == 4 else PRIORITY_HIGH,
+        )
+
+        task = dict(args, id=temp_id, description=description or "")
+        task.setdefault("due", None)
+        self.tasks[temp_id] = task
+        self._index_task(task)
+        self._undo.append((command_uuid, lambda: self._drop_task(task)))
+        return task
+
+    def update_task(self, task, content, description, project_id, priority, due_string):
+        """
+        Queues an update containing only the fields that changed, and re-indexes the local copy
+        """
+        args = {}
+        if content != task["content"]:
+            args["content"] = content
+        if description is not None and description != task["description"]:
+            args["description"] = description
+        if priority != task["priority"]:
+            args["priority"] = priority
+        if due_string is not None and due_string != (task["due"] or {}).get("string"):
+            args["due"] = {"string": due_string}
+
+        self._unindex_task(task)
+        if args:
+            # Description-only updates are deferred when the request budget is low
+            command_uuid = self.sync_helper.queue(
+                "item_update",
+                dict(args, id=task["id"]),
+                priority=(
+                    PRIORITY_LOW if list(args) == ["description"] else PRIORITY_NORMAL
+                ),
+            )
+            self._queue_undo_update(command_uuid, task, args)
+        if project_id is not None and project_id != task["project_id"]:
+            # Moving a task is a separate command in the Sync API
+            command_uuid = self.sync_helper.queue(
+                "item_move", {"id": task["id"], "project_id": project_id}
+            )
+            self._queue_undo_update(command_uuid, task, {"project_id": project_id})
+            args["project_id"] = project_id
+        task.update(args)
+        self._index_task(task)
+        return task
+
+    def _queue_undo_update(self, command_uuid, task, args):
+        previous = {key: task.get(key) for key in args}
+        self._undo.append((command_uuid, lambda: self._restore_fields(task, previous)))
+
+    def close_task(self, task):
+        """
+        Queues closing a task and drops it from the local task indexes
+        """
+        command_uuid = self.sync_helper.queue(
+            "item_close", {"id": task["id"]}, priority=PRIORITY_URGENT
+        )
+        self._drop_task(task)
+        self._undo.append((command_uuid, lambda: self._restore_task(task)))
+
+    def _drop_task(self, task):
+        self._unindex_task(task)
+        self.tasks.pop(task["id"], None)
+
+    def _restore_task(self, task):
+        self.tasks[task["id"]] = task
+        self._index_task(task)
+
+    def _restore_fields(self, task, fields):
+        self._unindex_task(task)
+        task.update(fields)
+        self._index_task(task)
+
+    def flush(self):
+        """
+        Sends all queued writes to Todoist and swaps temp ids for real ids.
+        Deferred writes are retried on the next run, as their assignments aren't marked as synced.
+        Writes that failed or were deferred are undone in the local copy, newest first,
+        so it keeps matching Todoist and the next run compares against the real tasks.
+        """
+        temp_id_mapping = self.sync_helper.flush()
+        for command_uuid, undo in reversed(self._undo):
+            if not self.sync_helper.is_ok(command_uuid):
+                undo()
+        self._undo = []
+        for temp_id, real_id in temp_id_mapping.items():
+            task = self.tasks.pop(temp_id, None)
+            if task is not None:
+                task["id"] = real_id
+                self.tasks[real_id] = task
+
+    def _register_project(self, project):
+        if project["name"] in self.project_ids:
+            self.duplicate_project_names.add(project["name"])
+            return
+        self.project_ids[project["name"]] = project["id"]
+
     def get_project_names(self) -> list:
         """
         Loads all user projects from Todoist
         """
-        project_names = []
-        for project in self.projects:
-            project_names.append(project.name)
-        return project_names
+        return list(self.project_ids)
 
     def get_project_id(self, project_name):
         """
         Returns the project id corresponding to project_name
         """
-        project_ids = []
-        for project in self.projects:
-            if project.name == project_name:
-                project_ids.append(project.id)
-
-        if len(project_ids) == 0:
+        if project_name not in self.project_ids:
             log_i(
                 f'Could not find project "{project_name}"',
             )
             return None
 
-        if len(project_ids) > 1:
+        if project_name in self.duplicate_project_names:
             log_w(
                 f"Found multiple projects with the name {project_name}",
                 show_notify=True,
             )
 
-        return project_ids[0]
+        return self.project_ids[project_name]
 
     def create_projects(self, proj_names_list: list):
         """
         Checks to see if the user has a project matching their course names.
-        If there isn't, a new project will be created
+        All missing projects are created in one batch and added to the project registry.
         """
         logging.info("# Creating Todoist projects:")
+        missing = []
         for i, course_name in enumerate(proj_names_list):
-            if not self.create_project(course_name):
+            if course_name in self.project_ids or course_name in missing:
                 logging.info(
                     f'  {i + 1}. INFO: "{course_name}" already exists; skipping...'
                 )
+            else:
+                missing.append(course_name)
+
+        if not missing:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(len(missing), 8)) as executor:
+            for project in executor.map(self._add_project, missing):
+                project = {"id": project.id, "name": project.name}
+                self.projects[project["id"]] = project
+                self._register_project(project)
+                logging.info(f' - OK: Created Project: "{project["name"]}"')
+
+    def _add_project(self, name):
+        if self.budget is not None:
+            self.budget.spend()
+        return self.api.add_project(name=name)
 
     def create_project(self, proj_name):
-        if proj_name in self.get_project_names():
+        if proj_name in self.project_ids:
             return False
 
-        self.api.add_project(name=proj_name)
+        project = self._add_project(proj_name)
+        project = {"id": project.id, "name": project.name}
+        self.projects[project["id"]] = project
+        self._register_project(project)
         logging.info(f' - OK: Created Project: "{proj_name}"')
         return True
 
@@ -100,6 +378,14 @@ class TodoistHelper:
         """
         return f"[{title}]({url})"
 
+    @staticmethod
+    def parse_link_url(content):
+        """
+        Extracts the URL from a task title created by make_link_title
+        """
+        match = re.fullmatch(r"\[.*\]\((.+)\)", content or "", re.DOTALL)
+        return match.group(1) if match else None
+
     @staticmethod
     def get_priority_name(priority: int):
         """
@@ -137,3 +423,7 @@ class TodoistHelper:
                 priority = 4
 
         return priority
+
+    def log_stats(self):
+        if self.budget is not None:
+            self.budget.log_stats()
@@ -0,0 +1,206 @@
+import json
+import logging
+import time
+import uuid
+
+import requests
+
+from src.helpers.LogHelper import log_e
+
+SYNC_URL = "https://api.todoist.com/sync/v9/sync"
+
+# Command priorities, lowest first. Low priority commands are deferred when the budget is low.
+PRIORITY_URGENT = 0
+PRIORITY_HIGH = 1
+PRIORITY_NORMAL = 2
+PRIORITY_LOW = 3
+
+
+class TodoistSyncHelper:
+    # The Sync API accepts at most 100 commands per request
+    max_batch_size = 100
+    # Retries of requests answered with 429 Too Many Requests
+    max_retries = 3
+    backoff = 2.0
+
+    def __init__(self, api_key, sync_url=SYNC_URL, timeout=30, budget=None):
+        self.sync_url = sync_url
+        self.timeout = timeout
+        # Shared count of Todoist requests, see BudgetHelper.RequestBudget
+        self.budget = budget
+        self.command_priority = {}
+        self.header = {"Authorization": f"Bearer {api_key.strip()}"}
+        self.commands = []
+        self.command_status = {}
+        self.temp_id_mapping = {}
+        self.num_requests = 0
+
+    def queue(self, command_type, args, temp_id=None, priority=PRIORITY_NORMAL):
+        """
+        Adds a command to the queue and returns its uuid
+        """
+        command = {"type": command_type, "uuid": str(uuid.uuid4()), "args": args}
+        if temp_id is not None:
+            command["temp_id"] = temp_id
+        self.commands.append(command)
+        self.command_priority[command["uuid"]] = priority
+        return command["uuid"]
+
+    def mark(self):
+        """
+        Returns a position in the queue, to be passed to uuids_since
+        """
+        return len(self.commands)
+
+    def uuids_since(self, mark):
+        return [command["uuid"] for command in self.commands[mark:]]
+
+    @staticmethod
+    def new_temp_id():
+        return str(uuid.uuid4())
+
+    def resolve_id(self, object_id):
+        """
+        Returns the real id for a temp id once its command has been flushed
+        """
+        return self.temp_id_mapping.get(object_id, object_id)
+
+    def is_ok(self, command_uuid):
+        return self.command_status.get(command_uuid) == "ok"
+
+    def read(self, sync_token, resource_types):
+        """
+        Requests the given resources changed since sync_token ("*" for everything).
+        Returns None if the request fails or the token is rejected.
+        """
+        if self.budget is not None and not self.budget.spend():
+            log_e("Todoist request budget used up, syncing anyway")
+        try:
+            response = self._post(
+                {
+                    "sync_token": sync_token,
+                    "resource_types": json.dumps(resource_types),
+                }
+            )
+        except requests.RequestException as e:
+            log_e(f"Todoist sync request failed: {e}")
+            return None
+
+        if response.status_code != 200:
+            log_e(f"Todoist sync error: {response.status_code} - {response.text}")
+            return None
+
+        return response.json()
+
+    def flush(self):
+        """
+        Sends all queued commands, at most max_batch_size per request, highest priority first.
+        When the request budget is low, low priority commands are deferred to a later run,
+        and commands that can't be sent within the budget are marked "deferred".
+        Returns the temp id mapping collected from the responses.
+        """
+        if not self.commands:
+            return self.temp_id_mapping
+
+        commands, self.commands = self.commands, []
+        # Commands of the same priority keep the order they were queued in
+        commands = [
+            command
+            for _, _, command in sorted(
+                (self.command_priority[command["uuid"]], index, command)
+                for index, command in enumerate(commands)
+            )
+        ]
+        if self.budget is not None:
+            num_batches = (len(commands) - 1) // self.max_batch_size + 1
+            if self.budget.is_low(num_batches):
+                deferred = [
+                    c
+                    for c in commands
+                    if self.command_priority[c["uuid"]] == PRIORITY_LOW
+                ]
+                if deferred:
+                    logging.info(
+                        f"# Todoist request budget is low ({self.budget.remaining()} left), "
+                        f"deferring {len(deferred)} low priority commands"
+                    )
+                    self._defer(deferred)
+                    commands = commands[: len(commands) - len(deferred)]
+            if not commands:
+                return self.temp_id_mapping
+
+        num_batches = (len(commands) - 1) // self.max_batch_size + 1
+        logging.info(
+            f"# Sending {len(commands)} Todoist commands in {num_batches} request(s)"
+        )
+        for start in range(0, len(commands), self.max_batch_size):
+            batch = commands[start : start + self.max_batch_size]
+            for command in batch:
+                # Commands queued against objects created in an earlier batch
+                for key in ("id", "project_id"):
+                    if key in command["args"]:
+                        command["args"][key] = self.resolve_id(command["args"][key])
+            if self.budget is not None and not self.budget.spend():
+                log_e(
+                    "Todoist request budget used up, deferring the remaining commands"
+                )
+                self._defer(commands[start:])
+                break
+            self.send(batch)
+
+        return self.temp_id_mapping
+
+    def _defer(self, commands):
+        for command in commands:
+            self.command_status[command["uuid"]] = "deferred"
+
+    def _post(self, data):
+        """
+        Posts to the Sync API, retrying while Todoist answers 429 Too Many Requests
+        """
+        attempt = 0
+        while True:
+            self.num_requests += 1
+            response = requests.post(
+                self.sync_url, headers=self.header, data=data, timeout=self.timeout
+            )
+            if response.status_code != 429 or attempt >= self.max_retries:
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            delay = (
+                float(retry_after)
+                if retry_after.isdigit()
+                else self.backoff * 2**attempt
+            )
+            logging.info(f"  - Todoist rate limit hit, retrying in {round(delay)}s")
+            time.sleep(delay)
+            attempt += 1
+            if self.budget is not None:
+                # A retry is another request against the budget
+                self.budget.spend()
+
+    def send(self, batch):
+        try:
+            response = self._post({"commands": json.dumps(batch)})
+        except requests.RequestException as e:
+            log_e(f"Todoist sync request failed: {e}", show_notify=True)
+            for command in batch:
+                self.command_status[command["uuid"]] = str(e)
+            return
+
+        if response.status_code != 200:
+            log_e(
+                f"Todoist sync error: {response.status_code} - {response.text}",
+                show_notify=True,
+            )
+            for command in batch:
+                self.command_status[command["uuid"]] = response.status_code
+            return
+
+        result = response.json()
+        self.temp_id_mapping.update(result.get("temp_id_mapping", {}))
+        for command in batch:
+            status = result.get("sync_status", {}).get(command["uuid"])
+            self.command_status[command["uuid"]] = status
+            if status != "ok":
+                log_e(f"Todoist command {command['type']} failed: {status}")
@@ -0,0 +1,245 @@
+import logging
+from concurrent.futures import Future
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.helpers.CacheHelper import HttpCache
+from src.helpers.RateLimitHelper import ConcurrencyController, RateLimitedAdapter
+from src.Utils import get_cache_path
+
+
+class CanvasRequestError(Exception):
+    def __init__(self, response):
+        self.status_code = response.status_code
+        super().__init__(
+            f"{response.status_code} - {response.reason} for {response.url}"
+        )
+
+
+def create_session(
+    pool_size=10, host_pool_sizes=None, controller=None, limited_hosts=()
+):
+    """
+    Creates a keep-alive session with connection pools of pool_size per host.
+    host_pool_sizes maps a host name to its own pool size.
+    With a controller, requests to limited_hosts (the Canvas hosts) go through its
+    concurrency limit; other hosts, e.g. file redirects and image hosts, don't.
+    """
+    host_pool_sizes = dict(host_pool_sizes or {})
+    for host in limited_hosts:
+        host_pool_sizes.setdefault(host, pool_size)
+
+    session = requests.Session()
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    session.mount("https://", HTTPAdapter(pool_maxsize=pool_size))
+    session.mount("http://", HTTPAdapter(pool_maxsize=pool_size))
+    for host, host_pool_size in host_pool_sizes.items():
+        kwargs = {"pool_connections": 1, "pool_maxsize": int(host_pool_size)}
+        if controller is not None and host in limited_hosts:
+            adapter = RateLimitedAdapter(controller, **kwargs)
+        else:
+            adapter = HTTPAdapter(**kwargs)
+        session.mount(f"https://{host}/", adapter)
+        session.mount(f"http://{host}/", adapter)
+    return session
+
+
+def get_host(url):
+    return urlparse(url).netloc
+
+
+class CanvasTransport:
+    def __init__(
+        self,
+        api_key,
+        canvas_api_heading="https://canvas.instructure.com",
+        session=None,
+        http_cache=None,
+        connect_timeout=5,
+        read_timeout=30,
+        controller=None,
+    ):
+        self.canvas_api_heading = canvas_api_heading
+        self.header = {"Authorization": f"Bearer {api_key.strip()}"}
+        # Adapts the number of concurrent requests to the Canvas rate limit
+        if session is None:
+            controller = controller or ConcurrencyController()
+            session = create_session(
+                controller=controller, limited_hosts=[get_host(canvas_api_heading)]
+            )
+        self.controller = controller
+        self.session = session
+        self.http_cache = http_cache
+        self.timeout = (connect_timeout, read_timeout)
+
+    @classmethod
+    def from_config(cls, config_helper, session=None, controller=None, http_cache=None):
+        """
+        Creates a transport using the http_* settings from the configuration file.
+        A session, with its controller, and an HTTP cache can be shared between accounts.
+        """
+        max_workers = int(config_helper.get("canvas_max_workers") or 8)
+        # Crawling and downloading each run up to max_workers requests
+        pool_size = int(config_helper.get("http_pool_size") or 2 * max_workers)
+        if session is None:
+            controller = ConcurrencyController(
+                initial_limit=max_workers,
+                max_limit=int(config_helper.get("canvas_max_concurrency") or pool_size),
+            )
+            session = create_session(
+                pool_size=pool_size,
+                host_pool_sizes=config_helper.get("http_host_pool_sizes"),
+                controller=controller,
+                limited_hosts=[get_host(str(config_helper.get("canvas_api_heading")))],
+            )
+        if http_cache is None:
+            http_cache = HttpCache(
+                get_cache_path("canvas-http-cache.sqlite"),
+                max_size_mb=float(config_helper.get("http_cache_max_mb") or 64),
+            )
+        return cls(
+            config_helper.get("canvas_api_key"),
+            canvas_api_heading=str(config_helper.get("canvas_api_heading")),
+            session=session,
+            http_cache=http_cache,
+            connect_timeout=float(config_helper.get("http_connect_timeout") or 5),
+            read_timeout=float(config_helper.get("http_read_timeout") or 30),
+            controller=controller,
+        )
+
+    def get(self, url, params=None, stream=False, use_cache=False, headers=None):
+        """
+        GET request through the pooled session.
+        With use_cache, the request is revalidated against the HTTP cache.
+        """
+        request_headers = dict(self.header, **(headers or {}))
+        if use_cache and self.http_cache is not None and not stream:
+            return self.http_cache.get(
+                url,
+                headers=request_headers,
+                params=params,
+                timeout=self.timeout,
+                get=self.session.get,
+            )
+        return self.session.get(
+            url,
+            headers=request_headers,
+            params=params,
+            stream=stream,
+            timeout=self.timeout,
+        )
+
+    def get_paginated(self, url, params=None, executor=None):
+        """
+        Fetches every page of a paginated Canvas listing.
+        When Canvas exposes a numbered `last` link, the remaining pages are requested
+        concurrently on `executor`; otherwise the `next` links are followed one by one.
+        Returns a list of futures (one per page, in order) and the error status code, if any.
+        A page requested concurrently that fails raises CanvasRequestError from its future.
+        """
+        response = self.get(url, params, use_cache=True)
+        if response.status_code != 200:
+            self._log_error(response)
+            return [], response.status_code
+
+        pages = [_completed(response.json())]
+        last_page = self._get_page_number(response.links.get("last"))
+        next_link = response.links.get("next")
+
+        if executor is not None and last_page is not None and next_link is not None:
+            # Page numbers are known, so every page can be requested at once
+            for page in range(2, last_page + 1):
+                page_params = dict(params or {}, page=str(page))
+                pages.append(executor.submit(self._get_page, url, page_params))
+            return pages, None
+
+        while next_link is not None:
+            response = self.get(next_link["url"], use_cache=True)
+            if response.status_code != 200:
+                self._log_error(response)
+                return pages, response.status_code
+            pages.append(_completed(response.json()))
+            next_link = response.links.get("next")
+
+        return pages, None
+
+    def get_all(self, url, params=None, executor=None):
+        """
+        Returns the items of every page of a paginated listing, and the error status code, if any
+        """
+        pages, status = self.get_paginated(url, params, executor)
+        items = []
+        for page in pages:
+            try:
+                items.extend(page.result())
+            except CanvasRequestError as e:
+                return items, e.status_code
+        return items, status
+
+    def _get_page(self, url, params):
+        response = self.get(url, params, use_cache=True)
+        if response.status_code != 200:
+            self._log_error(response)
+            # An empty page would pass for a listing with fewer items
+            raise CanvasRequestError(response)
+        return response.json()
+
+    @staticmethod
+    def _get_page_number(link):
+        if link is None:
+            return None
+        page = parse_qs(urlparse(link["url"]).query).get("page")
+        if not page or not page[0].isdigit():
+            # Canvas uses opaque bookmarks for some listings
+            return None
+        return int(page[0])
+
+    @staticmethod
+    def _log_error(response):
+        logging.error(
+            f"Error: {response.status_code} - {response.reason} - {response.text}"
+        )
+
+    def get_connection_stats(self):
+        return get_connection_stats(self.session)
+
+    def log_stats(self):
+        log_transport_stats(self.session, self.http_cache, self.controller)
+
+
+def get_connection_stats(session):
+    """
+    Returns the number of requests sent and connections opened by the session's pools
+    """
+    num_requests = 0
+    num_connections = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+    return num_requests, num_connections
+
+
+def log_transport_stats(session, http_cache=None, controller=None):
+    num_requests, num_connections = get_connection_stats(session)
+    logging.info(
+        f"# HTTP connections: {num_requests} requests over {num_connections} connections "
+        f"({max(num_requests - num_connections, 0)} reused)"
+    )
+    if http_cache is not None:
+        http_cache.log_stats()
+    if controller is not None:
+        controller.log_stats()
+
+
+def _completed(result):
+    """
+    Wraps an already available result so it can be consumed like a future
+    """
+    future = Future()
+    future.set_result(result)
+    return future
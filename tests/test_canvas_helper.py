@@ -0,0 +1,63 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from src.helpers.CanvasHelper import CanvasHelper
+from src.helpers.TransportHelper import CanvasTransport, create_session
+
+COURSES = [
+    {"id": i, "name": f"Course {i}", "course_code": f"CS {i}", "term": {}}
+    for i in range(1, 4)
+]
+
+
+class _CanvasHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        page = int(parse_qs(url.query).get("page", ["1"])[0])
+        self.server.requests.append((url.path, dict(self.headers)))
+        payload = json.dumps(COURSES[page - 1 : page]).encode("utf-8")
+        self.send_response(200)
+        if page < len(COURSES):
+            base = f"http://127.0.0.1:{self.server.server_port}{url.path}"
+            self.send_header("Link", f'<{base}?page={page + 1}>; rel="next"')
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@pytest.fixture
+def canvas_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _CanvasHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_courses_are_listed_through_the_shared_transport(canvas_server):
+    heading = f"http://127.0.0.1:{canvas_server.server_port}"
+    session = create_session()
+    session.headers["X-Test-Session"] = "shared"
+    transport = CanvasTransport("key", heading, session=session)
+    canvas_helper = CanvasHelper("key", heading, transport=transport)
+
+    courses = canvas_helper.get_courses()
+
+    assert sorted(courses) == [1, 2, 3]
+    assert courses[1] == "CS1 - Course 1"
+    # Every page went through the given session, following the next links
+    assert len(canvas_server.requests) == 3
+    for path, headers in canvas_server.requests:
+        assert path == "/api/v1/courses"
+        assert headers["X-Test-Session"] == "shared"
+        assert headers["Authorization"] == "Bearer key"
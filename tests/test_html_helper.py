@@ -0,0 +1,42 @@
+import pytest
+
+from src.helpers.HtmlHelper import image_name, localize_images
+
+URL = "https://canvas.example.com/files/1/preview?a=1&b=2"
+LOCAL = f'"./img/{image_name(URL)}"'
+
+
+@pytest.mark.parametrize(
+    "tag, expected",
+    [
+        # src= inside the quoted value of another attribute
+        (
+            f"<img alt=\"src=foo\" src='{URL}'/>",
+            f'<img alt="src=foo" src={LOCAL}/>',
+        ),
+        (
+            f'<img onerror="this.src=\'x.png\'" src="{URL.replace("&", "&amp;")}">',
+            f"<img onerror=\"this.src='x.png'\" src={LOCAL}>",
+        ),
+        # Uppercase tag and attribute names, unquoted value
+        (f"<IMG SRC={URL} ALT=x>", f"<IMG SRC={LOCAL} ALT=x>"),
+        # data-src is not src
+        (
+            f'<img data-src="https://other.example.com/x.png" src="{URL}">',
+            f'<img data-src="https://other.example.com/x.png" src={LOCAL}>',
+        ),
+    ],
+)
+def test_fast_engine_rewrites_only_the_src_attribute(tag, expected):
+    html, img_urls = localize_images(f"<p>before</p>\n<p>{tag}</p>")
+
+    assert html == f"<p>before</p>\n<p>{expected}</p>"
+    assert img_urls == [URL]
+
+
+def test_fast_engine_keeps_local_images_and_the_rest_of_the_page():
+    body = (
+        '<div class="x">\n<img src="./local.png">\n<img data-src="https://a/b">\n</div>'
+    )
+
+    assert localize_images(body) == (body, [])
@@ -0,0 +1,77 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from src.helpers.TodoistHelper import TodoistHelper
+
+TASK = {
+    "id": "1",
+    "project_id": "p1",
+    "content": "Assignment",
+    "description": "old",
+    "priority": 1,
+    "due": None,
+}
+
+
+class _SyncHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if "commands" in form:
+            # Every write fails
+            commands = json.loads(form["commands"][0])
+            body = {
+                "sync_status": {
+                    command["uuid"]: {"error_code": 22, "error": "Invalid id"}
+                    for command in commands
+                },
+                "temp_id_mapping": {},
+            }
+        elif form["sync_token"][0] == "*":
+            body = {
+                "full_sync": True,
+                "sync_token": "t1",
+                "items": [dict(TASK)],
+                "projects": [{"id": "p1", "name": "Course"}],
+            }
+        else:
+            body = {"full_sync": False, "sync_token": "t2", "items": [], "projects": []}
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@pytest.fixture
+def todoist_helper():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SyncHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield TodoistHelper("token", sync_url=f"http://127.0.0.1:{server.server_port}/sync")
+    server.shutdown()
+    server.server_close()
+
+
+def test_failed_writes_are_undone_in_the_local_copy(todoist_helper):
+    task = todoist_helper.tasks["1"]
+    todoist_helper.update_task(task, "Renamed", "new", "p2", 4, None)
+    added = todoist_helper.add_task("New", "", "p1", 1, None)
+    todoist_helper.close_task(todoist_helper.tasks["1"])
+
+    todoist_helper.flush()
+    todoist_helper.refresh()
+
+    # The local copy still matches Todoist, so the next run sends the writes again
+    assert todoist_helper.tasks == {"1": TASK}
+    assert todoist_helper.find_task("p1", "Assignment") == TASK
+    assert todoist_helper.find_task("p1", "New") is None
+    assert added["id"] not in todoist_helper.tasks
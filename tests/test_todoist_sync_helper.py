@@ -0,0 +1,117 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from src.helpers.TodoistSyncHelper import TodoistSyncHelper
+
+
+class _SyncHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        commands = json.loads(form["commands"][0])
+        self.server.requests.append(commands)
+        status, headers, body = self.server.respond(commands)
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def _apply(commands, failing_types=()):
+    """
+    Answers like the Sync API: every command ok, except those of failing_types,
+    and a real id for every temp id
+    """
+    sync_status = {}
+    temp_id_mapping = {}
+    for command in commands:
+        if command["type"] in failing_types:
+            sync_status[command["uuid"]] = {"error_code": 22, "error": "Invalid id"}
+            continue
+        sync_status[command["uuid"]] = "ok"
+        if "temp_id" in command:
+            temp_id_mapping[command["temp_id"]] = f"real-{command['temp_id']}"
+    return 200, {}, {"sync_status": sync_status, "temp_id_mapping": temp_id_mapping}
+
+
+@pytest.fixture
+def sync_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SyncHandler)
+    server.requests = []
+    server.respond = _apply
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sync_helper(sync_server):
+    helper = TodoistSyncHelper(
+        "token", sync_url=f"http://127.0.0.1:{sync_server.server_port}/sync"
+    )
+    helper.backoff = 0
+    return helper
+
+
+def test_flush_applies_commands_and_remaps_temp_ids(sync_server, sync_helper):
+    sync_helper.max_batch_size = 1
+    project_temp_id = sync_helper.new_temp_id()
+    add_project = sync_helper.queue(
+        "project_add", {"name": "Course"}, temp_id=project_temp_id
+    )
+    add_item = sync_helper.queue(
+        "item_add",
+        {"content": "Assignment", "project_id": project_temp_id},
+        temp_id=sync_helper.new_temp_id(),
+    )
+
+    mapping = sync_helper.flush()
+
+    assert mapping[project_temp_id] == f"real-{project_temp_id}"
+    assert sync_helper.resolve_id(project_temp_id) == f"real-{project_temp_id}"
+    assert sync_helper.is_ok(add_project) and sync_helper.is_ok(add_item)
+    # The item was sent in a later batch, with the project's real id
+    assert len(sync_server.requests) == 2
+    assert sync_server.requests[1][0]["args"]["project_id"] == mapping[project_temp_id]
+
+
+def test_flush_records_partial_command_errors(sync_server, sync_helper):
+    sync_server.respond = lambda commands: _apply(commands, ("item_close",))
+    added = sync_helper.queue(
+        "item_add", {"content": "A"}, temp_id=sync_helper.new_temp_id()
+    )
+    closed = sync_helper.queue("item_close", {"id": "123"})
+
+    sync_helper.flush()
+
+    assert len(sync_server.requests) == 1
+    assert sync_helper.is_ok(added)
+    assert not sync_helper.is_ok(closed)
+    assert sync_helper.command_status[closed]["error_code"] == 22
+
+
+def test_flush_retries_rate_limited_requests(sync_server, sync_helper):
+    responses = [(429, {"Retry-After": "0"}, {"error": "Too many requests"})]
+    sync_server.respond = lambda commands: (
+        responses.pop(0) if responses else _apply(commands)
+    )
+    added = sync_helper.queue("item_add", {"content": "A"})
+
+    sync_helper.flush()
+
+    assert len(sync_server.requests) == 2
+    assert sync_helper.num_requests == 2
+    assert sync_helper.is_ok(added)